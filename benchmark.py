@@ -0,0 +1,387 @@
+"""
+benchmark.py
+Timings of the pipeline stages (make_network, make_cascade, load_infopath,
+load_prior, update, mae and pair_dist), each measured on its own over
+fixtures of several sizes: the bundled sim, TB, SARS and Ebola data and
+synthetic networks of 10^2 to 10^5 nodes. The EdgeGraph forms of the loaders
+and the update (load_infopath_graph, load_prior_graph, update_graph) are timed
+next to the networkx ones. Results are written as JSON so runs
+from two versions of the code can be compared:
+
+    python benchmark.py -o before.json
+    ... change the code ...
+    python benchmark.py -o after.json --compare before.json
+
+Run it from the top of the repository (the bundled data is found relative to
+the working directory). Every file a stage reads is copied into a scratch
+directory first, so the InfoPath caches written next to them stay out of the
+tree and each load_infopath/update timing parses from scratch.
+"""
+
+from simrep import make_cascade, make_network
+from netrate import write_inferred
+from streams import make_rng
+from update import *
+from utils import mae, pair_dist
+import numpy as np
+
+import argparse
+import json
+import os
+import platform
+import scipy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import networkx as nx
+
+# bundled data sets: file each stage reads (None where a set has no such
+# file); 'estimate' is scored against 'truth' by mae over 'network' nodes
+DATASETS = {
+    'sim': {
+        'infopath': None,
+        'prior': 'sim_data/sim_data_truth.txt',
+        'estimate': 'sim_data/sim_data_truth.txt',
+        'truth': 'sim_data/sim_data_truth.txt',
+        'network': 'sim_data/sim_data_network.txt',
+    },
+    'tb': {
+        'infopath': 'tb_data/tb_inferred.txt',
+        'prior': 'tb_data/prior_edgelist_tb.txt',
+        'estimate': 'tb_data/tb_updated_avg.txt',
+        'truth': 'tb_data/tb-truth-newlabel.txt',
+        'network': 'tb_data/tb-network.txt',
+    },
+    'sars': {
+        'infopath': 'sars_data/sars-inferred.txt',
+        'prior': 'sars_data/prior_edgelist_sars.txt',
+        'estimate': None,
+        'truth': None,
+        'network': 'sars_data/sars-network.txt',
+    },
+    'ebola': {
+        'infopath': None,
+        'prior': 'ebola_data/ebola_prior_edgelist.txt',
+        'estimate': 'ebola_data/ebola_updated_avg.txt',
+        'truth': 'ebola_data/ebola_inferred_avg.txt',
+        'network': 'ebola_data/ebola_network.txt',
+    },
+}
+
+# synthetic network sizes
+SCALES = [100, 1000, 10000, 100000]
+
+# mean out-degree of the synthetic networks
+DEGREE = 5
+
+# largest synthetic size each stage is run at: load_prior builds the complete
+# graph and pair_dist the dense distance matrix, both quadratic in the nodes
+MAX_NODES = {
+    'load_prior': 1000,
+    'pair_dist': 2000,
+}
+
+# sequence length of the synthetic pair_dist fixtures
+SEQ_LEN = 1000
+
+
+"""
+time_stage
+    Function to time one stage, taking the best and median of several
+    repeats. setup is called before every repeat, outside the timing.
+    @param: stage function (no arguments), setup function or None, repeat,
+    number - calls per repeat
+    @ret: dictionary of the per-call times
+"""
+def time_stage(fn, setup=None, repeat=3, number=1):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = timeit.default_timer()
+        for _ in range(number):
+            fn()
+        times.append((timeit.default_timer() - start) / number)
+    return {
+        'repeat': repeat,
+        'number': number,
+        'times': times,
+        'best': min(times),
+        'median': float(np.median(times)),
+    }
+
+
+"""
+clear_infopath_cache
+    Setup function forcing the next load_infopath/update call to parse the
+    file (and the prior) again.
+    @param: InfoPath file name
+    @ret: function
+"""
+def clear_infopath_cache(fname):
+    def setup():
+        INFOPATH_CACHE.clear()
+        PRIOR_CACHE.clear()
+        cache = os.path.splitext(fname)[0] + '_cache.npz'
+        if os.path.exists(cache):
+            os.remove(cache)
+    return setup
+
+
+"""
+read_edgelist
+    Function to read a u,v,weight edge list whether it is comma or space
+    separated.
+    @param: file name
+    @ret: (E x 3) array
+"""
+def read_edgelist(fname):
+    f = open(fname)
+    first = f.readline()
+    f.close()
+    delimiter = ',' if ',' in first else None
+    return np.loadtxt(fname, delimiter=delimiter, ndmin=2)
+
+
+"""
+copy_prior
+    Function to copy a prior edge list into the scratch directory as the
+    comma separated file load_prior reads.
+    @param: prior file name, scratch directory
+    @ret: name of the copy
+"""
+def copy_prior(fname, scratch):
+    outname = os.path.join(scratch, os.path.basename(fname))
+    np.savetxt(outname, read_edgelist(fname), delimiter=',', fmt='%.10g')
+    return outname
+
+
+"""
+dataset_fixtures
+    Function to list the stage fixtures of a bundled data set.
+    @param: data set name, scratch directory
+    @ret: list of (stage, fixture description, stage function, setup) tuples
+"""
+def dataset_fixtures(name, scratch):
+    files = DATASETS[name]
+    scratch = os.path.join(scratch, name)
+    os.makedirs(scratch)
+    fixtures = []
+
+    prior = None
+    if files['prior'] is not None:
+        prior = copy_prior(files['prior'], scratch)
+        num_nodes = len(np.unique(read_edgelist(prior)[:,:2]))
+        fixtures.append(('load_prior', {'nodes': num_nodes},
+            lambda: load_prior(prior), PRIOR_CACHE.clear))
+        fixtures.append(('load_prior_graph', {'nodes': num_nodes},
+            lambda: load_prior_graph(prior), PRIOR_CACHE.clear))
+
+    if files['infopath'] is not None:
+        info = os.path.join(scratch, os.path.basename(files['infopath']))
+        shutil.copyfile(files['infopath'], info)
+        fixtures.append(('load_infopath', {}, lambda: load_infopath(info),
+            clear_infopath_cache(info)))
+        fixtures.append(('load_infopath_graph', {},
+            lambda: load_infopath_graph(info), clear_infopath_cache(info)))
+        if prior is not None:
+            fixtures.append(('update', {}, lambda: update(info, prior),
+                clear_infopath_cache(info)))
+            fixtures.append(('update_graph', {},
+                lambda: update_graph(info, prior), clear_infopath_cache(info)))
+
+    if files['estimate'] is not None:
+        estimate = read_edgelist(files['estimate'])
+        truth = read_edgelist(files['truth'])
+        node_names = np.loadtxt(files['network'], delimiter=',', usecols=(0,),
+                dtype=np.int64, ndmin=1).tolist()
+        fixtures.append(('mae', {'edges': len(truth)},
+            lambda: mae(estimate, truth, node_names), None))
+
+    return fixtures
+
+
+"""
+synthetic_fixtures
+    Function to list the stage fixtures of a synthetic network: an
+    Erdos-Renyi network with DEGREE mean out-degree, its edges as the prior,
+    a noisy InfoPath-format estimate of half of them and random sequences.
+    @param: number of nodes, scratch directory, stages to build fixtures for,
+    seed
+    @ret: list of (stage, fixture description, stage function, setup) tuples
+"""
+def synthetic_fixtures(num_nodes, scratch, stages, seed=0):
+    rng = make_rng(seed)
+    scratch = os.path.join(scratch, 'synthetic_%d' % num_nodes)
+    os.makedirs(scratch)
+
+    p = min(float(DEGREE) / (num_nodes - 1), 1.)
+    a, b = 1., 2.
+    G = make_network(num_nodes, p, a, b, rng)
+    info = {'nodes': num_nodes, 'edges': G.number_of_edges()}
+    fixtures = [('make_network', info,
+        lambda: make_network(num_nodes, p, a, b, rng), None)]
+    fixtures.append(('make_cascade', info,
+        lambda: make_cascade(G, 10, False, rng=rng), None))
+
+    edges = np.column_stack((G.src(), G.indices, G.rate))
+    prior = os.path.join(scratch, 'prior.txt')
+    np.savetxt(prior, edges, delimiter=',', fmt='%d,%d,%.10g')
+
+    # half of the edges, recovered with multiplicative noise
+    seen = edges[rng.uniform(size=len(edges)) < .5]
+    seen[:,2] *= rng.lognormal(0., .5, len(seen))
+    infoname = os.path.join(scratch, 'inferred.txt')
+    write_inferred(infoname, list(range(num_nodes)),
+            seen[:,0].astype(np.int64), seen[:,1].astype(np.int64),
+            seen[:,2], 10.)
+
+    fixtures.append(('load_infopath', info,
+        lambda: load_infopath(infoname), clear_infopath_cache(infoname)))
+    fixtures.append(('load_infopath_graph', info,
+        lambda: load_infopath_graph(infoname),
+        clear_infopath_cache(infoname)))
+    fixtures.append(('update', info, lambda: update(infoname, prior),
+        clear_infopath_cache(infoname)))
+    fixtures.append(('update_graph', info,
+        lambda: update_graph(infoname, prior), clear_infopath_cache(infoname)))
+    fixtures.append(('load_prior_graph', info,
+        lambda: load_prior_graph(prior), PRIOR_CACHE.clear))
+    node_names = list(range(num_nodes))
+    fixtures.append(('mae', info, lambda: mae(seen, edges, node_names), None))
+
+    if num_nodes <= MAX_NODES['load_prior']:
+        fixtures.append(('load_prior', info, lambda: load_prior(prior),
+            PRIOR_CACHE.clear))
+
+    if num_nodes <= MAX_NODES['pair_dist'] and 'pair_dist' in stages:
+        seqs = np.array(list('ACGT'))[rng.choice(4,
+            size=(num_nodes, SEQ_LEN))]
+        seq_info = {'nodes': num_nodes, 'seq_len': SEQ_LEN}
+        fixtures.append(('pair_dist', seq_info, lambda: pair_dist(seqs),
+            None))
+        fixtures.append(('pair_dist_packed', seq_info,
+            lambda: pair_dist(seqs, packed=True), None))
+
+    return [fix for fix in fixtures if fix[0] in stages]
+
+
+"""
+run_benchmarks
+    Function to time every stage over every fixture.
+    @param: data set names, synthetic sizes, stages to run, repeat, seed,
+    verbose - print each timing as it finishes
+    @ret: list of result dictionaries
+"""
+def run_benchmarks(datasets, scales, stages, repeat=3, seed=0, verbose=True):
+    scratch = tempfile.mkdtemp(prefix='benchmark_')
+    results = []
+    try:
+        groups = [(name, lambda name=name: dataset_fixtures(name, scratch))
+                for name in datasets]
+        groups += [('synthetic_%d' % n, lambda n=n: synthetic_fixtures(n,
+            scratch, stages, seed)) for n in scales]
+
+        for fixture, build in groups:
+            for stage, info, fn, setup in build():
+                if stage not in stages:
+                    continue
+                # make_cascade is cheap per call, so time a batch of them
+                number = 10 if stage == 'make_cascade' else 1
+                res = time_stage(fn, setup, repeat, number)
+                res.update({'stage': stage, 'fixture': fixture})
+                res.update(info)
+                results.append(res)
+                if verbose:
+                    print('%-20s %-18s %12.6f s' % (stage, fixture,
+                        res['best']))
+                    sys.stdout.flush()
+    finally:
+        shutil.rmtree(scratch)
+    return results
+
+
+"""
+environment
+    Description of the machine and library versions a run was made with.
+"""
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                stderr=open(os.devnull, 'w')).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'networkx': nx.__version__,
+    }
+
+
+"""
+compare_results
+    Function to compare the best times of two runs fixture by fixture.
+    @param: old and new result lists, tolerance - relative slowdown allowed
+    before a timing counts as a regression
+    @ret: list of (stage, fixture, old best, new best) regressions
+"""
+def compare_results(old, new, tolerance=0.2):
+    old_best = dict(((res['stage'], res['fixture']), res['best'])
+            for res in old)
+    regressions = []
+    for res in new:
+        key = (res['stage'], res['fixture'])
+        if key not in old_best:
+            continue
+        ratio = res['best'] / max(old_best[key], 1e-12)
+        flag = ''
+        if ratio > 1. + tolerance:
+            flag = '  REGRESSION'
+            regressions.append((key[0], key[1], old_best[key], res['best']))
+        print('%-20s %-18s %12.6f -> %12.6f s  x%.2f%s' % (key[0], key[1],
+            old_best[key], res['best'], ratio, flag))
+    return regressions
+
+
+def main():
+    stage_names = ['make_network', 'make_cascade', 'load_infopath',
+            'load_infopath_graph', 'load_prior', 'load_prior_graph', 'update',
+            'update_graph', 'mae', 'pair_dist', 'pair_dist_packed']
+
+    parser = argparse.ArgumentParser(description='Time the pipeline stages.')
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--datasets', nargs='*', default=sorted(DATASETS))
+    parser.add_argument('--scales', nargs='*', type=int, default=SCALES)
+    parser.add_argument('--stages', nargs='*', default=stage_names)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', help='earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.datasets, args.scales, args.stages,
+            args.repeat, args.seed)
+
+    f = open(args.output, 'w')
+    json.dump({'environment': environment(), 'results': results}, f,
+            indent=2, sort_keys=True)
+    f.close()
+
+    if args.compare:
+        f = open(args.compare)
+        old = json.load(f)['results']
+        f.close()
+        if compare_results(old, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
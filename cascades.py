@@ -0,0 +1,306 @@
+"""
+cascades.py
+Batched cascade simulation on a network stored as a CSR adjacency. All of the
+edge delays for a batch of cascades are drawn as one (K x E) matrix and the
+infection times come back as one (K x N) array.
+"""
+
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from edgegraph import EdgeGraph
+import numpy as np
+
+import profiling
+
+# number of float64 cells (cascades x edges) simulated at once
+CHUNK_CELLS = 2 ** 22
+
+
+"""
+to_csr
+    Function to convert a networkx graph into CSR arrays.
+    @param: networkx graph G (or an EdgeGraph, whose arrays are returned as
+    they are), weight - edge attribute holding the rate
+    @ret: list of node ids, indptr, indices and rate arrays (row i of the CSR
+    holds the out-edges of node_lst[i])
+"""
+def to_csr(G, weight='trans_rate'):
+    if isinstance(G, EdgeGraph):
+        return G.nodes, G.indptr, G.indices, G.rate
+
+    node_lst = list(G.nodes())
+    index = dict((node, i) for i, node in enumerate(node_lst))
+
+    indptr = np.zeros(len(node_lst) + 1, dtype=np.int64)
+    indices = []
+    rates = []
+    for i, node in enumerate(node_lst):
+        for n in G.neighbors(node):
+            indices.append(index[n])
+            rates.append(G[node][n].get(weight, 1.))
+        indptr[i + 1] = len(indices)
+
+    return (node_lst, indptr, np.array(indices, dtype=np.int64),
+            np.array(rates, dtype=np.float64))
+
+
+"""
+simulate_cascades
+    Function to simulate many cascades at once. The exponential delays of every
+    edge in a chunk of cascades are drawn as one (K x E) matrix, and each
+    cascade's infection times are the shortest-path arrival times from its
+    source under those delays, computed with scipy's compiled Dijkstra on a
+    single CSR matrix whose data is swapped per cascade.
+    @param: CSR arrays indptr, indices, rates, num_cascades, max_time -
+    observation window, sources - optional source node per cascade (random by
+    default), voter_model - unit delays instead of exponential ones, rng -
+    object with standard_exponential/choice (np.random by default)
+    @ret: (num_cascades x N) array of infection times, +inf if never infected
+"""
+def simulate_cascades(indptr, indices, rates, num_cascades, max_time,
+        sources=None, voter_model=False, rng=None):
+    if rng is None:
+        rng = np.random
+
+    indptr = np.asarray(indptr)
+    indices = np.asarray(indices)
+    rates = np.asarray(rates, dtype=np.float64)
+    num_nodes = len(indptr) - 1
+    num_edges = len(indices)
+
+    if sources is None:
+        sources = rng.choice(num_nodes, num_cascades)
+    sources = np.asarray(sources)
+
+    times = np.empty((num_cascades, num_nodes))
+    times.fill(np.inf)
+    times[np.arange(num_cascades), sources] = 0.
+    if num_edges == 0:
+        return times
+
+    scale = 1. / rates
+    M = csr_matrix((np.ones(num_edges), indices, indptr),
+            shape=(num_nodes, num_nodes))
+
+    chunk = max(1, CHUNK_CELLS // num_edges)
+    for lo in range(0, num_cascades, chunk):
+        hi = min(lo + chunk, num_cascades)
+        if voter_model:
+            delays = np.ones((hi - lo, num_edges))
+        else:
+            delays = rng.standard_exponential((hi - lo, num_edges)) * scale
+
+        for k in range(lo, hi):
+            M.data = delays[k - lo]
+            times[k] = dijkstra(M, indices=sources[k], limit=max_time)
+
+    profiling.count('cascades', num_cascades)
+    return times
+
+
+"""
+times_to_cascades
+    Function to convert infection-time rows into cascade lists in the format
+    used by cascades_to_file.
+    @param: (K x N) infection times, list of node ids for the columns
+    @ret: dictionary (cascade_id -> list of (node_id, infection_time)) ordered
+    by infection time
+"""
+def times_to_cascades(times, node_lst):
+    cascade_dict = {}
+    for i, row in enumerate(times):
+        infected = np.flatnonzero(np.isfinite(row))
+        infected = infected[np.argsort(row[infected], kind='mergesort')]
+        cascade_dict[i] = [(node_lst[j], row[j]) for j in infected]
+
+    return cascade_dict
+
+
+"""
+cascades_to_times
+    Function to convert cascade lists back into an infection-time array.
+    @param: dictionary (cascade_id -> list of (node_id, infection_time)), list
+    of node ids for the columns
+    @ret: (num_cascades x N) infection times, +inf if never infected
+"""
+def cascades_to_times(cascade_dict, node_lst):
+    index = dict((node, j) for j, node in enumerate(node_lst))
+    keys = sorted(cascade_dict.keys())
+
+    times = np.empty((len(keys), len(node_lst)))
+    times.fill(np.inf)
+    for i, key in enumerate(keys):
+        for node, t in cascade_dict[key]:
+            times[i, index[node]] = t
+
+    return times
+
+
+# header of the binary cascade container: magic, number of cascades and
+# number of infections, followed by the int64 offsets, the int32 nodes and the
+# float64 times
+CASCADE_MAGIC = b'CASCADE1'
+CASCADE_HEADER = 24
+
+
+"""
+times_to_csr
+    Function to convert an infection-time array into CSR cascade columns.
+    @param: (K x N) infection times, +inf if never infected
+    @ret: offsets (K + 1), node column indices and infection times, each
+    cascade's infections ordered by time
+"""
+def times_to_csr(times):
+    times = np.asarray(times)
+    counts = np.isfinite(times).sum(axis=1)
+    offsets = np.zeros(times.shape[0] + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # sorting each row puts its infections first, in time order
+    order = np.argsort(times, axis=1, kind='mergesort')
+    infected = np.arange(times.shape[1]) < counts[:,None]
+    vals = np.take_along_axis(times, order, axis=1)[infected]
+    return offsets, order[infected].astype(np.int32), vals
+
+
+"""
+cascades_to_csr
+    Function to convert cascade lists into CSR cascade columns, cascades in
+    order of their ids.
+    @param: dictionary (cascade_id -> list of (node_id, infection_time)) with
+    integer node ids
+    @ret: offsets (K + 1), node ids and infection times
+"""
+def cascades_to_csr(cascade_dict):
+    keys = sorted(cascade_dict.keys())
+    lengths = [len(cascade_dict[key]) for key in keys]
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    pairs = [pair for key in keys for pair in cascade_dict[key]]
+    pairs = np.array(pairs, dtype=np.float64).reshape(-1, 2)
+    return offsets, pairs[:,0].astype(np.int32), pairs[:,1]
+
+
+"""
+csr_to_times
+    Function to expand CSR cascade columns into an infection-time array.
+    @param: offsets, node column indices, infection times, N
+    @ret: (K x N) infection times, +inf if never infected
+"""
+def csr_to_times(offsets, nodes, times, num_nodes):
+    out = np.empty((len(offsets) - 1, num_nodes))
+    out.fill(np.inf)
+    rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    out[rows, nodes] = times
+    return out
+
+
+"""
+write_cascades
+    Function to write cascades to the binary container through a memory map,
+    keeping full time precision.
+    @param: outfile name, offsets, nodes, infection times
+    @ret: n/a
+"""
+def write_cascades(outfile_name, offsets, nodes, times):
+    num_cascades = len(offsets) - 1
+    num_infections = len(nodes)
+    size = cascade_layout(num_cascades, num_infections)[-1]
+
+    out = np.memmap(outfile_name, dtype=np.uint8, mode='w+', shape=(size,))
+    out[:8] = np.frombuffer(CASCADE_MAGIC, dtype=np.uint8)
+    out[8:CASCADE_HEADER].view(np.int64)[:] = [num_cascades, num_infections]
+    for arr, dtype, (lo, hi) in zip((offsets, nodes, times),
+            (np.int64, np.int32, np.float64),
+            cascade_sections(num_cascades, num_infections)):
+        out[lo:hi].view(dtype)[:] = arr
+    out.flush()
+    del out
+
+
+"""
+read_cascades
+    Function to open a binary cascade container as read-only memory maps.
+    @param: file name
+    @ret: offsets, nodes and infection times
+"""
+def read_cascades(fname):
+    header = np.fromfile(fname, dtype=np.uint8, count=CASCADE_HEADER)
+    if header[:8].tobytes() != CASCADE_MAGIC:
+        raise ValueError(fname + ' is not a binary cascade file')
+    num_cascades, num_infections = header[8:].view(np.int64)
+
+    arrays = []
+    for dtype, (lo, hi) in zip((np.int64, np.int32, np.float64),
+            cascade_sections(num_cascades, num_infections)):
+        count = (hi - lo) // np.dtype(dtype).itemsize
+        if count:
+            arrays.append(np.memmap(fname, dtype=dtype, mode='r', offset=lo,
+                shape=(count,)))
+        else:
+            arrays.append(np.zeros(0, dtype=dtype))
+    return tuple(arrays)
+
+
+"""
+is_cascade_file
+    Whether a file is a binary cascade container (rather than InfoPath text).
+"""
+def is_cascade_file(fname):
+    f = open(fname, 'rb')
+    magic = f.read(len(CASCADE_MAGIC))
+    f.close()
+    return magic == CASCADE_MAGIC
+
+
+"""
+read_cascade_text
+    Function to read cascades in the InfoPath input format written by
+    cascades_to_file: id lines, a blank line, then one
+    cascade_id;node,time,node,time,... line per cascade. The id lines list
+    the cascades in the files written here and the nodes in InfoPath's own.
+    @param: file name
+    @ret: list of the ids before the blank line, dictionary (cascade_id ->
+    list of (node_id, infection_time))
+"""
+def read_cascade_text(fname):
+    f = open(fname)
+    ids = []
+    l = f.readline()
+    while l.strip():
+        ids.append(int(l.split(',')[0]))
+        l = f.readline()
+
+    cascade_dict = {}
+    for l in f:
+        if not l.strip():
+            continue
+        key, rest = l.strip().split(';', 1) if ';' in l else (l.strip(), '')
+        values = rest.split(',') if rest else []
+        cascade_dict[int(key)] = [(int(values[k]), float(values[k + 1]))
+                for k in range(0, len(values) - 1, 2)]
+    f.close()
+    return ids, cascade_dict
+
+
+"""
+cascade_sections
+    Byte ranges of the offsets, nodes and times in a binary cascade file; the
+    times start on an 8-byte boundary.
+"""
+def cascade_sections(num_cascades, num_infections):
+    bounds = cascade_layout(num_cascades, num_infections)
+    return [(bounds[0], bounds[1]), (bounds[1], bounds[2]),
+            (bounds[3], bounds[4])]
+
+"""
+cascade_layout
+    Byte offsets of the start of each section and of the end of the file.
+"""
+def cascade_layout(num_cascades, num_infections):
+    offsets_end = CASCADE_HEADER + 8 * (num_cascades + 1)
+    nodes_end = offsets_end + 4 * num_infections
+    times_start = nodes_end + (-nodes_end) % 8
+    return (CASCADE_HEADER, offsets_end, nodes_end, times_start,
+            times_start + 8 * num_infections)
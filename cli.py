@@ -0,0 +1,612 @@
+"""
+cli.py
+One command-line entry point for the pipeline stages:
+
+    python cli.py ingest --metadata ebola_data/ebola_data.csv --out ebola
+    python cli.py prior --sequences ebola.fasta --out ebola_prior --k 10 \
+            --threshold 20 --index
+    python cli.py simulate --dir 0 --num-nodes 50 --num-cascades 100 --seed 1
+    python cli.py simulate --dir 1 --num-nodes 50 --network-kind scale_free \
+            --degree 2 --seed 1
+    python cli.py infer --cascades 0/sim_cascades.bin --network \
+            0/sim_network.txt --out 0/sim_inferred.txt --max-time 10
+    python cli.py update --inferred 0/sim_inferred.txt --prior 0/sim_truth.txt
+    python cli.py score --inferred 0/sim_inferred.txt --truth 0/sim_truth.txt \
+            --updated 0/sim_inferred_updated_avg.txt
+    python cli.py batch nightly.json
+
+batch runs every job of a JSON manifest in this one process, so the
+interpreter starts and the pipeline modules are imported once for the whole
+run:
+
+    {
+        "output": "batch_results.csv",  (one row per job: label, command,
+                                        status, seconds and its results)
+        "keep_going": false,            (carry on past a failed job)
+        "defaults": {"score": {"prior_rate": 0.5}},
+        "jobs": [
+            {"label": "tb", "command": "update",
+             "inferred": "tb_data/tb_inferred.txt",
+             "prior": "tb_data/prior_edgelist_tb.txt"},
+            ...
+        ]
+    }
+
+Job keys are the long option names with '_' for '-', and relative paths are
+taken from the manifest's directory. Parsed InfoPath files and priors (see
+update.cached_read_infopath and update.load_prior_sparse) and the node lists,
+cascades and edge lists read here are kept for the life of the process,
+keyed by path, size and mtime, so jobs sharing a prior or a truth network read
+it once.
+"""
+
+import numpy as np
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import timeit
+import traceback
+
+# options holding file names, resolved against the manifest's directory
+PATH_OPTIONS = ['dir', 'cascades', 'network', 'out', 'out_avg', 'inferred',
+        'prior', 'truth', 'updated', 'nodes', 'metadata', 'cleaned',
+        'sequences', 'edgelist']
+
+# parsed files, keyed by the reader and each file's (path, size, mtime)
+FILE_CACHE = {}
+
+
+"""
+cached
+    Function to read files through FILE_CACHE; the result is shared by every
+    caller, so treat it as read-only.
+    @param: reader function (file names -> value), file names
+    @ret: what the reader returns
+"""
+def cached(reader, *fnames):
+    paths = [os.path.abspath(fname) for fname in fnames]
+    key = [reader.__name__]
+    for path in paths:
+        stat = os.stat(path)
+        key += [path, stat.st_size, stat.st_mtime]
+    key = tuple(key)
+    if key not in FILE_CACHE:
+        FILE_CACHE[key] = reader(*paths)
+    return FILE_CACHE[key]
+
+
+"""
+read_edges
+    Function to read a weighted edge list: InfoPath output (the last rate of
+    every edge), a prior store (the prior mean of every edge) or a u,v,weight
+    list, comma or space separated. A list of bare u,v pairs gets a weight
+    column of nan.
+    @param: file name or store directory
+    @ret: (E x 3) array
+"""
+def read_edges(fname):
+    from update import load_infopath_graph
+
+    if os.path.isdir(fname):
+        from posterior_store import store_edges
+        src, dst, alpha, beta = store_edges(fname)
+        return np.column_stack((src, dst, alpha / beta)).astype(np.float64)
+
+    if is_infopath(fname):
+        edges = load_infopath_graph(fname).edge_list('rate')
+        return np.array(edges, dtype=np.float64).reshape(-1, 3)
+
+    f = open(fname)
+    first = f.readline()
+    f.close()
+    delimiter = ',' if ',' in first else None
+    edges = np.loadtxt(fname, delimiter=delimiter, ndmin=2)
+    if edges.shape[1] == 2:
+        edges = np.column_stack((edges, np.empty(len(edges)) * np.nan))
+    return edges[:,:3]
+
+
+"""
+is_infopath
+    Whether a file is in the InfoPath layout: node lines, a blank line, then
+    edge lines.
+"""
+def is_infopath(fname):
+    f = open(fname)
+    blank = False
+    for l in f:
+        if not l.strip():
+            blank = True
+        elif blank:
+            f.close()
+            return True
+    f.close()
+    return False
+
+
+"""
+read_times
+    Function to read cascades (InfoPath text or a binary cascade file) as an
+    infection-time array over the nodes of a network file.
+    @param: cascade file name, network file name
+    @ret: (num_cascades x N) infection times, +inf if never infected
+"""
+def read_times(fname, network_file):
+    from cascades import (cascades_to_times, csr_to_times, is_cascade_file,
+            read_cascade_text, read_cascades)
+    from utils import nodes
+
+    node_lst = cached(nodes, network_file)
+
+    if not is_cascade_file(fname):
+        return cascades_to_times(read_cascade_text(fname)[1], node_lst)
+
+    offsets, infected, times = read_cascades(fname)
+    names = np.asarray(node_lst)
+    order = np.argsort(names, kind='mergesort')
+    columns = order[np.searchsorted(names[order], infected)]
+    return csr_to_times(offsets, columns, times, len(node_lst))
+
+
+"""
+require
+    Checks that a command was given the options it cannot do without.
+    @param: options dictionary, option names
+    @ret: n/a
+"""
+def require(opts, *names):
+    missing = [name for name in names if opts.get(name) is None]
+    if missing:
+        raise ValueError(opts['command'] + ' needs ' + ', '.join('--' +
+            name.replace('_', '-') for name in missing))
+
+
+"""
+run_ingest
+    Turns a sequence metadata table into cascades and a network file (see
+    metadata.ingest).
+    @param: options dictionary
+    @ret: dictionary with the number of records, dated records and cascades
+"""
+def run_ingest(opts):
+    from metadata import DATE_PATTERN, ingest
+
+    require(opts, 'metadata', 'out')
+    return ingest(opts['metadata'], opts['out'], opts['id_column'],
+            opts['group_column'], opts['date_pattern'] or DATE_PATTERN,
+            opts['cleaned'])
+
+
+"""
+run_prior
+    Builds a prior store from the genetic distances between aligned
+    sequences (see prior.build_prior).
+    @param: options dictionary
+    @ret: dictionary with the number of sequences and prior edges
+"""
+def run_prior(opts):
+    from prior import build_prior, read_fasta
+
+    require(opts, 'sequences', 'out')
+    if opts['k'] is None and opts['threshold'] is None:
+        raise ValueError('prior needs --k and/or --threshold')
+    if opts['index'] and opts['threshold'] is None:
+        raise ValueError('prior --index needs --threshold')
+    names, seqarray = cached(read_fasta, opts['sequences'])
+    edges = build_prior(seqarray, opts['out'], opts['k'], opts['threshold'],
+            opts['alpha'], opts['beta'], opts['scale'], opts['packed'],
+            opts['edgelist'], opts['index'], opts['window'], opts['seed'],
+            opts['max_pairs'])
+    return {'nodes': len(names), 'edges': edges}
+
+
+"""
+run_simulate
+    Simulates a network and its cascades into a directory (see
+    simrep.make_infopath_input).
+    @param: options dictionary
+    @ret: dictionary with the number of nodes and cascades
+"""
+def run_simulate(opts):
+    from simrep import make_infopath_input
+    from streams import make_rng
+
+    require(opts, 'dir')
+    node_lst, times, max_time = make_infopath_input(opts['dir'],
+            opts['name'], num_nodes=opts['num_nodes'],
+            prob_edge_creation=opts['edge_prob'], alpha_param=opts['alpha'],
+            beta_param=opts['beta'], num_cascades=opts['num_cascades'],
+            cascade_max_time=opts['max_time'],
+            voter_model=opts['voter_model'], rng=make_rng(opts['seed']),
+            network_kind=opts['network_kind'], degree=opts['degree'],
+            num_blocks=opts['num_blocks'], cross_prob=opts['cross_prob'])
+    return {'nodes': len(node_lst), 'cascades': len(times)}
+
+
+"""
+run_infer
+    Infers the network behind a set of cascades, in-process with netrate or
+    by running an InfoPath binary, and writes it in the InfoPath output
+    format.
+    @param: options dictionary
+    @ret: dictionary with the number of inferred edges
+"""
+def run_infer(opts):
+    from utils import nodes
+
+    require(opts, 'cascades', 'network', 'out')
+    node_lst = cached(nodes, opts['network'])
+    times = cached(read_times, opts['cascades'], opts['network'])
+
+    max_time = opts['max_time']
+    if max_time is None:
+        finite = times[np.isfinite(times)]
+        max_time = float(finite.max()) if len(finite) else 0.
+
+    if opts['infopath'] is not None:
+        from cascades import is_cascade_file
+        if is_cascade_file(opts['cascades']):
+            raise ValueError('InfoPath reads text cascades only')
+        subprocess.check_call([
+            opts['infopath'],
+            '-i:' + opts['cascades'],
+            '-n:' + opts['network'],
+            '-o:' + os.path.splitext(opts['out'])[0],
+            '-ts:0.5', '-it:0', '-tt:' + str(max_time), '-s:0'
+        ])
+        return {}
+
+    from netrate import infer_network, write_inferred
+    src, dst, rates = infer_network(times, max_time, opts['threshold'],
+            processes=opts['processes'])
+    write_inferred(opts['out'], node_lst, src, dst, rates, max_time)
+    return {'edges': len(src)}
+
+
+"""
+run_update
+    Updates a prior network with inferred rates and writes the posterior
+    parameters and means (see update.update_wrapper). The outputs default to
+    <inferred>_updated.txt and <out>_avg.txt.
+    @param: options dictionary
+    @ret: dictionary with the output file names
+"""
+def run_update(opts):
+    from update import update_wrapper
+
+    require(opts, 'inferred', 'prior')
+    outname = opts['out']
+    if outname is None:
+        outname = os.path.splitext(opts['inferred'])[0] + '_updated.txt'
+    outavgname = opts['out_avg']
+    if outavgname is None:
+        outavgname = os.path.splitext(outname)[0] + '_avg.txt'
+
+    update_wrapper(opts['inferred'], opts['prior'], outname, outavgname,
+            verbose=opts['verbose'])
+    return {'out': outname, 'out_avg': outavgname}
+
+
+"""
+run_score
+    Scores the inferred network, and the updated one if given, against the
+    true network by MAE, as simrep's replicates and real_data do. The prior
+    is scored from its file or, without one, as prior_rate on every true
+    edge. Nodes come from --nodes (a network or InfoPath file) or else from
+    the inferred file.
+    @param: options dictionary
+    @ret: dictionary of infopath_mae, algo_mae (with --updated) and prior_mae
+"""
+def run_score(opts):
+    from update import cached_read_infopath
+    from utils import mae, nodes
+
+    require(opts, 'inferred', 'truth')
+    if opts['nodes'] is not None:
+        node_names = cached(nodes, opts['nodes'])
+    else:
+        node_names = cached_read_infopath(opts['inferred'])[0].tolist()
+    truth = cached(read_edges, opts['truth'])
+
+    row = {'infopath_mae': mae(cached(read_edges, opts['inferred']), truth,
+        node_names)}
+    if opts['updated'] is not None:
+        row['algo_mae'] = mae(cached(read_edges, opts['updated']), truth,
+                node_names)
+
+    if opts['prior'] is not None:
+        prior = np.copy(cached(read_edges, opts['prior']))
+        prior[np.isnan(prior[:,2]), 2] = opts['prior_rate']
+    else:
+        prior = np.copy(truth)
+        prior[:,2] = opts['prior_rate']
+    row['prior_mae'] = mae(prior, truth, node_names)
+
+    print('InfoPath MAE: ' + str(row['infopath_mae']))
+    if 'algo_mae' in row:
+        print('Algo MAE: ' + str(row['algo_mae']))
+    print('Prior MAE: ' + str(row['prior_mae']))
+    return row
+
+
+"""
+add_ingest_args
+    Options of the ingest command.
+"""
+def add_ingest_args(parser):
+    parser.add_argument('--metadata', help='metadata CSV, one row per '
+            'sequence')
+    parser.add_argument('--out', help='prefix of the cascade and network '
+            'files')
+    parser.add_argument('--id-column', default='ebola_id',
+            help='column of the ids holding the dates')
+    parser.add_argument('--group-column', default='clade',
+            help='column grouping the rows into cascades')
+    parser.add_argument('--date-pattern', help='regex with one group '
+            'matching the date (yyyy-mm-dd by default)')
+    parser.add_argument('--cleaned', help='also save the table with its '
+            'date and timestep columns')
+
+
+"""
+add_prior_args
+    Options of the prior command.
+"""
+def add_prior_args(parser):
+    parser.add_argument('--sequences', help='aligned FASTA file')
+    parser.add_argument('--out', help='prior store directory')
+    parser.add_argument('--k', type=int, help='nearest neighbours kept per '
+            'sequence')
+    parser.add_argument('--threshold', type=float, help='largest Hamming '
+            'distance kept')
+    parser.add_argument('--alpha', type=float, default=1.,
+            help='gamma shape of every prior edge')
+    parser.add_argument('--beta', type=float, default=2.,
+            help='gamma rate at distance 0')
+    parser.add_argument('--scale', type=float, help='distance over which '
+            'the prior mean falls by a factor e (the median distance by '
+            'default)')
+    parser.add_argument('--packed', action='store_true',
+            help='2-bit packed distances (A/C/G/T only)')
+    parser.add_argument('--edgelist', help='also write the u,v,prior mean '
+            'edge list')
+    parser.add_argument('--index', action='store_true', help='find the '
+            'pairs within --threshold through an index instead of comparing '
+            'every pair')
+    parser.add_argument('--window', type=int, default=64, help='bucket '
+            'neighbours compared per sequence in buckets too big to search '
+            'in full')
+    parser.add_argument('--max-pairs', type=int, default=2 ** 24,
+            help='pairs per segment the index compares in full')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the '
+            "index's segment split")
+
+
+"""
+add_simulate_args
+    Options of the simulate command.
+"""
+def add_simulate_args(parser):
+    parser.add_argument('--dir', help='directory the files are written to')
+    parser.add_argument('--name', default='sim', help='file name prefix')
+    parser.add_argument('--num-nodes', type=int, default=10)
+    parser.add_argument('--network-kind', default='er',
+            choices=['er', 'sbm', 'small_world', 'scale_free'],
+            help='random graph the cascades run on')
+    parser.add_argument('--edge-prob', type=float, default=0.5,
+            help='edge probability (er), within-block edge probability '
+            '(sbm) or rewiring probability (small_world)')
+    parser.add_argument('--degree', type=int, default=4, help='ring '
+            'neighbours (small_world) or edges per new node (scale_free)')
+    parser.add_argument('--num-blocks', type=int, default=2,
+            help='blocks of the sbm')
+    parser.add_argument('--cross-prob', type=float, help='edge probability '
+            'between sbm blocks (--edge-prob / 10 by default)')
+    parser.add_argument('--alpha', type=float, default=1.,
+            help='gamma shape of the transmission rates')
+    parser.add_argument('--beta', type=float, default=2.,
+            help='gamma rate of the transmission rates')
+    parser.add_argument('--num-cascades', type=int, default=10)
+    parser.add_argument('--max-time', type=float, default=10.,
+            help='cascade observation window')
+    parser.add_argument('--independent', dest='voter_model',
+            action='store_false', help='independent cascade model instead '
+            'of the voter model')
+    parser.add_argument('--seed', type=int)
+
+
+"""
+add_infer_args
+    Options of the infer command.
+"""
+def add_infer_args(parser):
+    parser.add_argument('--cascades', help='InfoPath text or binary cascades')
+    parser.add_argument('--network', help='network file listing the nodes')
+    parser.add_argument('--out', help='inferred network file')
+    parser.add_argument('--max-time', type=float,
+            help='observation window (the last infection time by default)')
+    parser.add_argument('--threshold', type=float, default=1e-4,
+            help='smallest rate reported as an edge')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--infopath', metavar='BINARY',
+            help='run this InfoPath binary instead of netrate')
+
+
+"""
+add_update_args
+    Options of the update command.
+"""
+def add_update_args(parser):
+    parser.add_argument('--inferred', help='InfoPath network file')
+    parser.add_argument('--prior', help='prior edge list')
+    parser.add_argument('--out', help='posterior parameter file')
+    parser.add_argument('--out-avg', help='posterior mean edge list')
+    parser.add_argument('--verbose', action='store_true')
+
+
+"""
+add_score_args
+    Options of the score command.
+"""
+def add_score_args(parser):
+    parser.add_argument('--inferred', help='InfoPath network file')
+    parser.add_argument('--truth', help='true network')
+    parser.add_argument('--updated', help='posterior mean edge list')
+    parser.add_argument('--prior', help='prior edge list')
+    parser.add_argument('--prior-rate', type=float, default=0.5,
+            help='rate of prior edges without one')
+    parser.add_argument('--nodes', help='network or InfoPath file listing '
+            'the nodes')
+
+
+# command -> (option setup, function)
+COMMANDS = {
+    'ingest': (add_ingest_args, run_ingest),
+    'prior': (add_prior_args, run_prior),
+    'simulate': (add_simulate_args, run_simulate),
+    'infer': (add_infer_args, run_infer),
+    'update': (add_update_args, run_update),
+    'score': (add_score_args, run_score),
+}
+
+
+"""
+make_parser
+    Function to build the argument parser.
+    @param: n/a
+    @ret: parser, dictionary (command -> subparser)
+"""
+def make_parser():
+    parser = argparse.ArgumentParser(description='Run the network inference '
+            'pipeline.')
+    sub = parser.add_subparsers(dest='command')
+    subparsers = {}
+    for name in sorted(COMMANDS):
+        subparsers[name] = sub.add_parser(name)
+        COMMANDS[name][0](subparsers[name])
+
+    batch = sub.add_parser('batch', help='run the jobs of a JSON manifest')
+    batch.add_argument('manifest')
+    batch.add_argument('-o', '--output', help='results table (overrides the '
+            'manifest)')
+    batch.add_argument('--keep-going', action='store_true', default=None,
+            help='carry on past a failed job')
+    return parser, subparsers
+
+
+"""
+job_options
+    Function to turn a manifest job into the options dictionary of its
+    command: the command's defaults, then the manifest's defaults for it,
+    then the job's own keys.
+    @param: job dictionary, manifest defaults, subparsers, manifest directory
+    @ret: options dictionary
+"""
+def job_options(job, defaults, subparsers, root):
+    command = job.get('command')
+    if command not in COMMANDS:
+        raise ValueError('unknown command ' + str(command))
+
+    opts = vars(subparsers[command].parse_args([]))
+    known = set(opts) | set(['command'])
+    opts.update(defaults.get(command, {}))
+    opts.update(dict((key, value) for key, value in job.items()
+        if key != 'label'))
+
+    unknown = set(opts) - known
+    if unknown:
+        raise ValueError('unknown options for ' + command + ': ' +
+                ', '.join(sorted(unknown)))
+
+    for key in PATH_OPTIONS:
+        if opts.get(key) is not None:
+            opts[key] = os.path.join(root, opts[key])
+    return opts
+
+
+"""
+run_batch
+    Function to run every job of a manifest in this process and write one
+    results row per job. A failed job is reported with its traceback; the
+    batch stops there unless keep_going is set.
+    @param: manifest file name, output - results table (the manifest's
+    "output" by default), keep_going - None to use the manifest's setting
+    @ret: list of result rows (dictionaries)
+"""
+def run_batch(fname, output=None, keep_going=None):
+    f = open(fname)
+    manifest = json.load(f)
+    f.close()
+
+    root = os.path.dirname(os.path.abspath(fname))
+    if output is None:
+        output = os.path.join(root, manifest.get('output',
+            'batch_results.csv'))
+    if keep_going is None:
+        keep_going = manifest.get('keep_going', False)
+    defaults = manifest.get('defaults', {})
+    parser, subparsers = make_parser()
+
+    rows = []
+    for i, job in enumerate(manifest['jobs']):
+        row = {'job': i, 'label': job.get('label', i),
+                'command': job.get('command')}
+        start = timeit.default_timer()
+        try:
+            opts = job_options(job, defaults, subparsers, root)
+            row.update(COMMANDS[opts['command']][1](opts))
+            row['status'] = 'ok'
+        except Exception:
+            row['status'] = 'failed'
+            sys.stderr.write('job %d (%s) failed:\n' % (i, row['label']))
+            traceback.print_exc()
+        row['seconds'] = timeit.default_timer() - start
+        rows.append(row)
+        if row['status'] != 'ok' and not keep_going:
+            break
+
+    write_rows(output, rows)
+    return rows
+
+
+"""
+write_rows
+    Function to write the batch results as CSV: the job columns, then every
+    result key any job returned.
+    @param: outfile name, result rows
+    @ret: n/a
+"""
+def write_rows(outfile_name, rows):
+    columns = ['job', 'label', 'command', 'status', 'seconds']
+    columns += sorted(set(key for row in rows for key in row) - set(columns))
+
+    w = open(outfile_name, 'w+')
+    outcsv = csv.writer(w, delimiter=',', lineterminator='\n')
+    outcsv.writerow(columns)
+    for row in rows:
+        outcsv.writerow([row.get(name, '') for name in columns])
+    w.close()
+
+
+def main(argv=None):
+    parser, subparsers = make_parser()
+    args = vars(parser.parse_args(argv))
+
+    if args['command'] == 'batch':
+        rows = run_batch(args['manifest'], args['output'], args['keep_going'])
+        if any(row['status'] != 'ok' for row in rows):
+            sys.exit(1)
+        return
+
+    try:
+        COMMANDS[args['command']][1](args)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,21 @@
 ebola_data_clean.py
 
 File to take the strings from the Ebola network and convert into timestamps.
+The work is done a column at a time by metadata.py in the directory above
+(see metadata.ingest, which also handles other sequence metadata tables).
 """
 
-import csv
-import datetime
+import os
 import pandas as pd
-import re
+import sys
+
+# the pipeline modules live one directory up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir))
+
+from cascades import write_cascades
+from metadata import (date_steps, extract_dates, group_cascades,
+        write_cascade_text, write_network)
 
 
 """
@@ -17,27 +26,9 @@ str_to_date
 
 """
 def str_to_date(df):
-    regex_str = '2014-.*'
-
-    date_arr = []
-
-    min_date = datetime.datetime.today()
-
-    for index, row in df.iterrows():
-        s = row['ebola_id']
-        m = re.search(regex_str, s)
-
-        date_str = m.group(0)
-        date_val = datetime.datetime.strptime(date_str, '%Y-%m-%d')
-
-        date_arr.append(date_val)
-
-        if date_val < min_date:
-            min_date = date_val
-
-    df['date'] = date_arr
+    df['date'] = extract_dates(df['ebola_id'])
 
-    return min_date
+    return df['date'].min()
 
 
 """
@@ -47,50 +38,25 @@ date_to_step
 
 """
 def date_to_step(df, min_date):
-    t_arr = []
-
-    for index, row in df.iterrows():
-        date = row['date']
-
-        diff = date - min_date
-        t_arr.append(diff.days)
-
-    df['timestep'] = t_arr
+    df['timestep'] = date_steps(df['date'], min_date)
 
 
 """
 df_to_txt
-    Function to convert the dataframe of timesteps to cascades and network data
-    files necessary as input to the InfoPath algorithm.
+    Function to convert the dataframe of timesteps to cascades (InfoPath text
+    and a binary cascade file) and network data files necessary as input to
+    the InfoPath algorithm. There is one cascade per clade.
 
 """
 def df_to_txt(df, network_name):
-    outcsv = csv.writer(open(network_name + '_cascades.txt', 'w+'), delimiter=';',
-            quoting = csv.QUOTE_NONE)
-
-    for key in xrange(1, 5):
-        # cascade_id, cascade_name (same)
-        key_str = str(key)
-        outcsv.writerow([key_str + ',' + key_str])
-
-    outcsv.writerow([])
-
-    grouped_df = df.groupby('clade')
-
-    for clade, group in grouped_df:
-        lst_str = ''
-        for index, row in group.iterrows():
-            lst_str = lst_str + ',' + str(index) + ',' + str(row['timestep'])
-
-        outcsv.writerow([clade, lst_str[1:]])
+    groups, offsets, nodes, times = group_cascades(df, 'clade')
 
+    write_cascade_text(network_name + '_cascades.txt', groups, offsets, nodes,
+            times)
+    write_cascades(network_name + '_cascades.bin', offsets, nodes, times)
 
     # writing the network to a file as well
-    outcsv = csv.writer(open(network_name + '_network.txt', 'w+'), quoting =
-            csv.QUOTE_NONE)
-
-    for i in df.index:
-        outcsv.writerow([i, i])
+    write_network(network_name + '_network.txt', df.index.tolist())
 
 
 def main():
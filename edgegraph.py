@@ -0,0 +1,209 @@
+"""
+edgegraph.py
+Compact directed graph for the simulation and update pipeline. Nodes are
+numbered 0..N-1 (with a label <-> index map for the ids used in the files),
+out-edges are stored as CSR arrays sorted by (src, dst), and the per-edge
+values (transmission rate, posterior alpha and beta) are float arrays parallel
+to the edge arrays instead of a dictionary per edge. networkx graphs are only
+built where they are still needed (plotting, the functions that return
+them), through to_networkx and from_networkx, so networkx itself is only
+imported once a conversion is asked for.
+"""
+
+import numpy as np
+
+
+"""
+EdgeGraph
+    Directed graph with CSR out-edges. indices[indptr[i]:indptr[i+1]] are the
+    targets of node i, in increasing order, and rate/alpha/beta (each an array
+    or None) hold one value per edge in the same order.
+"""
+class EdgeGraph(object):
+    __slots__ = ('nodes', 'index', 'indptr', 'indices', 'rate', 'alpha',
+            'beta')
+
+    def __init__(self, nodes, indptr, indices, rate=None, alpha=None,
+            beta=None):
+        self.nodes = list(nodes)
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.rate = as_field(rate)
+        self.alpha = as_field(alpha)
+        self.beta = as_field(beta)
+
+    """
+    from_edges
+        Builds a graph from edges between node indices. Self loops are kept;
+        the last value given for a repeated edge wins.
+        @param: node labels, src and dst index arrays, per-edge rate, alpha
+        and beta arrays (or None)
+        @ret: EdgeGraph
+    """
+    @classmethod
+    def from_edges(cls, nodes, src, dst, rate=None, alpha=None, beta=None):
+        nodes = list(nodes)
+        num_nodes = len(nodes)
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+
+        # sorted unique (src, dst) keys, keeping the last of any repeats
+        keys = (src * num_nodes + dst)[::-1]
+        keys, first = np.unique(keys, return_index=True)
+        lines = len(src) - 1 - first
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // max(num_nodes, 1),
+            minlength=num_nodes), out=indptr[1:])
+        fields = [None if f is None else np.asarray(f, dtype=np.float64)[lines]
+                for f in (rate, alpha, beta)]
+        return cls(nodes, indptr, keys % max(num_nodes, 1), *fields)
+
+    """
+    from_labeled_edges
+        Builds a graph from edges between node labels. Endpoints missing from
+        nodes are added after them in order of their labels, as adding the
+        edges to a networkx graph would.
+        @param: node labels, src and dst label arrays, per-edge arrays
+        @ret: EdgeGraph
+    """
+    @classmethod
+    def from_labeled_edges(cls, nodes, src, dst, rate=None, alpha=None,
+            beta=None):
+        nodes = list(nodes)
+        known = set(nodes)
+        ends = np.unique(np.concatenate((np.asarray(src), np.asarray(dst))))
+        nodes += [n for n in ends.tolist() if n not in known]
+
+        labels = np.array(nodes)
+        order = np.argsort(labels, kind='mergesort')
+        def to_index(arr):
+            return order[np.searchsorted(labels[order], arr)]
+        return cls.from_edges(nodes, to_index(src), to_index(dst), rate, alpha,
+                beta)
+
+    """
+    from_networkx
+        Builds a graph from a networkx graph.
+        @param: networkx graph, rate - edge attribute holding the rate,
+        params - edge attribute holding (alpha, beta)
+        @ret: EdgeGraph
+    """
+    @classmethod
+    def from_networkx(cls, G, rate='trans_rate', params='params'):
+        nodes = list(G.nodes())
+        index = dict((node, i) for i, node in enumerate(nodes))
+        edges = list(G.edges(data=True))
+        src = [index[u] for u, v, d in edges]
+        dst = [index[v] for u, v, d in edges]
+
+        fields = [None, None, None]
+        if edges and rate in edges[0][2]:
+            fields[0] = [d[rate] for u, v, d in edges]
+        if edges and params in edges[0][2]:
+            fields[1] = [d[params][0] for u, v, d in edges]
+            fields[2] = [d[params][1] for u, v, d in edges]
+        return cls.from_edges(nodes, src, dst, *fields)
+
+    """
+    to_networkx
+        Converts the graph into a networkx DiGraph.
+        @param: rate - edge attribute to store the rate in, params - edge
+        attribute to store (alpha, beta) in
+        @ret: networkx DiGraph
+    """
+    def to_networkx(self, rate='trans_rate', params='params'):
+        import networkx as nx
+
+        G = nx.DiGraph()
+        G.add_nodes_from(self.nodes)
+        src, dst = self.edges()
+
+        names = []
+        columns = []
+        if self.rate is not None:
+            names.append(rate)
+            columns.append(self.rate.tolist())
+        if self.alpha is not None:
+            names.append(params)
+            columns.append(list(zip(self.alpha.tolist(), self.beta.tolist())))
+        if not names:
+            G.add_edges_from(zip(src, dst))
+            return G
+
+        # one attribute dictionary at a time, handed straight to networkx
+        G.add_edges_from((u, v, dict(zip(names, values))) for u, v, values
+                in zip(src, dst, zip(*columns)))
+        return G
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    """
+    src
+        Source index of every edge.
+    """
+    def src(self):
+        return np.repeat(np.arange(len(self.nodes), dtype=np.int64),
+                np.diff(self.indptr))
+
+    """
+    edges
+        Lists the edges as node labels.
+        @param: n/a
+        @ret: lists of src and dst labels
+    """
+    def edges(self):
+        return ([self.nodes[i] for i in self.src().tolist()],
+                [self.nodes[j] for j in self.indices.tolist()])
+
+    """
+    edge_list
+        Lists the edges with one of their values.
+        @param: field - 'rate', 'alpha' or 'beta'
+        @ret: list of (src label, dst label, value) tuples
+    """
+    def edge_list(self, field='rate'):
+        src, dst = self.edges()
+        return list(zip(src, dst, getattr(self, field).tolist()))
+
+    """
+    neighbors
+        Targets of a node's out-edges.
+        @param: node label
+        @ret: list of node labels
+    """
+    def neighbors(self, node):
+        i = self.index[node]
+        return [self.nodes[j] for j in
+                self.indices[self.indptr[i]:self.indptr[i + 1]].tolist()]
+
+    """
+    edge_position
+        Position of the edge u -> v in the edge arrays.
+        @param: src and dst labels
+        @ret: index into indices/rate/alpha/beta, -1 if there is no such edge
+    """
+    def edge_position(self, u, v):
+        i = self.index[u]
+        j = self.index[v]
+        lo = self.indptr[i]
+        hi = self.indptr[i + 1]
+        k = lo + np.searchsorted(self.indices[lo:hi], j)
+        if k < hi and self.indices[k] == j:
+            return int(k)
+        return -1
+
+
+"""
+as_field
+    Per-edge values as a float array (None stays None).
+"""
+def as_field(values):
+    if values is None:
+        return None
+    return np.asarray(values, dtype=np.float64)
@@ -0,0 +1,134 @@
+"""
+metadata.py
+Sequence metadata to cascades. The input is one row per sequence (the Ebola
+table in ebola_data, or a GISAID/GenBank export): an id string carrying the
+sampling date and a column grouping the sequences into cascades (a clade,
+lineage, ...). Every step is a column operation, so 10^5+ records take about
+a second: the dates are pulled out of the ids with str.extract and parsed by
+one pd.to_datetime call, and the cascades come from sorting the rows by
+group, however many groups there are. Rows without a date or a group are
+kept in the network but left out of the cascades.
+
+The cascades are written both as InfoPath text (as cascades_to_file writes
+them: the group ids, a blank line, then one group;node,time,... line per
+group) and as a binary cascade file (cascades.write_cascades).
+"""
+
+from cascades import write_cascades
+import numpy as np
+import pandas as pd
+
+import csv
+
+# a full yyyy-mm-dd date anywhere in the id
+DATE_PATTERN = r'(\d{4}-\d{2}-\d{2})'
+
+
+"""
+extract_dates
+    Function to parse the sampling date out of every id.
+    @param: series of id strings, pattern - regex with one group matching the
+    date, date_format - strptime format of the matched date
+    @ret: datetime series, NaT where there is no (valid) date
+"""
+def extract_dates(ids, pattern=DATE_PATTERN, date_format='%Y-%m-%d'):
+    dates = ids.astype(str).str.extract(pattern, expand=False)
+    return pd.to_datetime(dates, format=date_format, errors='coerce')
+
+
+"""
+date_steps
+    Function to convert dates into time steps in days, where t=0 on the
+    earliest (or the given) day.
+    @param: datetime series, start - day of t=0 (the earliest date by default)
+    @ret: series of steps (float with nan where the date is missing)
+"""
+def date_steps(dates, start=None):
+    if start is None:
+        start = dates.min()
+    return (dates - start).dt.days
+
+
+"""
+group_cascades
+    Function to build one cascade per group from the timed rows, in CSR form.
+    Groups are in sorted order and each cascade keeps the rows' order.
+    @param: dataframe, group column, time step column
+    @ret: group ids, offsets (num_groups + 1), node ids (the row index) and
+    infection times
+"""
+def group_cascades(df, group_column, step_column='timestep'):
+    rows = df[df[group_column].notnull() & df[step_column].notnull()]
+    codes, groups = pd.factorize(rows[group_column], sort=True)
+    groups = np.asarray(groups)
+
+    order = np.argsort(codes, kind='mergesort')
+    offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(groups)), out=offsets[1:])
+    nodes = np.asarray(rows.index, dtype=np.int64)[order]
+    times = rows[step_column].values.astype(np.float64)[order]
+    return groups, offsets, nodes, times
+
+
+"""
+write_cascade_text
+    Function to write cascades in the InfoPath input format.
+    @param: outfile name, group ids, offsets, node ids, infection times
+    @ret: n/a
+"""
+def write_cascade_text(outfile_name, groups, offsets, nodes, times):
+    pairs = ['%d,%.10g' % pair for pair in zip(nodes.tolist(), times.tolist())]
+
+    w = open(outfile_name, 'w+')
+    outcsv = csv.writer(w, delimiter=';', quoting = csv.QUOTE_NONE)
+    for group in groups.tolist():
+        # cascade_id, cascade_name (same)
+        outcsv.writerow(['%s,%s' % (group, group)])
+
+    outcsv.writerow([])
+
+    for i, group in enumerate(groups.tolist()):
+        outcsv.writerow([group, ','.join(pairs[offsets[i]:offsets[i + 1]])])
+    w.close()
+
+
+"""
+write_network
+    Function to write the nodes in the InfoPath network format.
+    @param: outfile name, node ids
+    @ret: n/a
+"""
+def write_network(outfile_name, node_ids):
+    w = open(outfile_name, 'w+')
+    outcsv = csv.writer(w, quoting = csv.QUOTE_NONE)
+    outcsv.writerows([i, i] for i in node_ids)
+    w.close()
+
+
+"""
+ingest
+    Function to turn a metadata table into the InfoPath inputs:
+    <prefix>_cascades.txt, <prefix>_cascades.bin and <prefix>_network.txt,
+    with the table plus its date and timestep columns saved to cleaned if
+    given. Nodes are the rows of the table, numbered from 0.
+    @param: metadata CSV name, output prefix, id column, group column, date
+    pattern (see extract_dates), cleaned CSV name or None
+    @ret: dictionary with the number of records, dated records and cascades
+"""
+def ingest(fname, prefix, id_column='ebola_id', group_column='clade',
+        pattern=DATE_PATTERN, cleaned=None):
+    df = pd.read_csv(fname)
+
+    df['date'] = extract_dates(df[id_column], pattern)
+    df['timestep'] = date_steps(df['date'])
+    if cleaned is not None:
+        df.to_csv(cleaned, index=False)
+
+    groups, offsets, nodes, times = group_cascades(df, group_column)
+    write_cascade_text(prefix + '_cascades.txt', groups, offsets, nodes,
+            times)
+    write_cascades(prefix + '_cascades.bin', offsets, nodes, times)
+    write_network(prefix + '_network.txt', df.index.tolist())
+
+    return {'records': len(df), 'dated': int(df['date'].notnull().sum()),
+            'cascades': len(groups)}
@@ -0,0 +1,178 @@
+"""
+netrate.py
+In-process network inference with the NetRate exponential model, replacing
+the call out to the InfoPath binary. The log-likelihood splits into one
+concave problem per target node i over its incoming rates a_ji >= 0:
+
+    sum over cascades where i is infected at t_i of log(sum_{t_j < t_i} a_ji)
+    - sum over all cascades of sum_{t_j < tau_i} a_ji (tau_i - t_j)
+
+with tau_i = min(t_i, T). Each problem is solved with multiplicative
+(EM-style) steps, a gradient step scaled by a / L that keeps the rates
+nonnegative and only needs two matrix-vector products per iteration.
+"""
+
+import numpy as np
+
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import os
+import tempfile
+
+
+"""
+node_problem
+    Function to build the data of node i's subproblem from the cascades.
+    @param: (K x N) infection times (+inf if never infected), node i, max_time
+    @ret: L - total exposure time to each possible parent (N), M - boolean
+    (cascades where i is infected x N) matrix of its possible parents
+"""
+def node_problem(times, i, max_time):
+    t_i = times[:, i]
+    tau = np.minimum(t_i, max_time)
+
+    # time each node had to infect i, 0 if it was infected after i or never
+    exposure = tau[:,None] - times
+    exposure[~(exposure > 0)] = 0.
+    exposure[:, i] = 0.
+    L = exposure.sum(axis=0)
+
+    # cascades i caught from someone (sources and late infections excluded)
+    caught = (t_i > 0) & (t_i <= max_time)
+    M = times[caught] < t_i[caught][:,None]
+    M[:, i] = False
+    # drop infections with no earlier node to explain them
+    M = M[M.any(axis=1)]
+    return L, M
+
+
+"""
+infer_node
+    Function to estimate node i's incoming transmission rates.
+    @param: (K x N) infection times, node i, max_time, penalty - L1 weight on
+    the rates (0 for the plain maximum likelihood estimate), max_iter, tol -
+    stop when no rate changes by more than tol relative to the largest rate
+    @ret: array of the N rates a_ji (0 for j == i)
+"""
+def infer_node(times, i, max_time, penalty=0., max_iter=1000, tol=1e-6):
+    L, M = node_problem(times, i, max_time)
+    M = M.astype(np.float64)
+
+    rates = np.zeros(len(L))
+    exposed = L > 0
+    if not M.shape[0] or not np.any(exposed):
+        return rates
+
+    # rates of parents never seen before an infection of i go straight to 0
+    rates[exposed] = M.shape[0] / np.sum(L)
+    denom = L + penalty
+    denom[~exposed] = 1.
+
+    for _ in range(max_iter):
+        hazard = np.dot(M, rates)
+        step = rates * np.dot(M.T, 1. / hazard) / denom
+        change = np.max(np.abs(step - rates))
+        rates = step
+        if change <= tol * max(np.max(rates), tol):
+            break
+
+    return rates
+
+
+"""
+node_edges
+    Function to estimate node i's incoming rates and keep those above the
+    threshold, so workers only send back the edges they found.
+    @param: (K x N) infection times, node i, max_time, threshold and the
+    infer_node options
+    @ret: arrays of parent indices and their rates
+"""
+def node_edges(times, i, max_time, threshold, penalty, max_iter, tol):
+    col = infer_node(times, i, max_time, penalty, max_iter, tol)
+    parents = np.flatnonzero(col > threshold)
+    return parents, col[parents]
+
+
+# infection times shared read-only by the worker processes of infer_network
+SHARED_TIMES = None
+
+"""
+open_shared_times
+    Pool initializer; maps the infection-time file once per worker process.
+"""
+def open_shared_times(path):
+    global SHARED_TIMES
+    SHARED_TIMES = np.load(path, mmap_mode='r')
+
+"""
+shared_node_worker
+    Pool entry point; runs node_edges on the worker's shared times.
+"""
+def shared_node_worker(task):
+    return node_edges(SHARED_TIMES, *task)
+
+
+"""
+infer_network
+    Function to estimate every transmission rate of the network. The per-node
+    problems are independent, so they can be spread over a pool: threads share
+    the times array directly (NumPy releases the GIL in the matrix products),
+    while worker processes map a read-only .npy copy of it instead of having
+    it pickled to them.
+    @param: (K x N) infection times, max_time, threshold - smallest rate
+    reported as an edge, the infer_node options, processes - pool size (1 runs
+    in this process, None uses every core), threads - use a thread pool
+    instead of processes
+    @ret: arrays of edge src, dst (column indices of times) and rates
+"""
+def infer_network(times, max_time, threshold=1e-4, penalty=0., max_iter=1000,
+        tol=1e-6, processes=1, threads=False):
+    times = np.asarray(times, dtype=np.float64)
+    num_nodes = times.shape[1]
+    tasks = [(i, max_time, threshold, penalty, max_iter, tol)
+            for i in range(num_nodes)]
+
+    if processes == 1:
+        found = [node_edges(times, *task) for task in tasks]
+    elif threads:
+        pool = ThreadPool(processes)
+        found = pool.map(lambda task: node_edges(times, *task), tasks)
+        pool.close()
+        pool.join()
+    else:
+        fd, path = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+        try:
+            np.save(path, times)
+            pool = multiprocessing.Pool(processes, open_shared_times, (path,))
+            found = pool.map(shared_node_worker, tasks)
+            pool.close()
+            pool.join()
+        finally:
+            os.remove(path)
+
+    src = [parents for parents, rates in found]
+    dst = [np.repeat(i, len(parents)) for i, (parents, rates) in
+            enumerate(found)]
+    rates = [rates for parents, rates in found]
+    return (np.concatenate(src).astype(np.int64),
+            np.concatenate(dst).astype(np.int64), np.concatenate(rates))
+
+
+"""
+write_inferred
+    Function to write inferred rates in the InfoPath output format (node lines,
+    a blank line, then src,dst,time,rate lines) so load_infopath and update
+    read them like an InfoPath run.
+    @param: outfile name, list of node ids, edge src and dst (indices into
+    node_lst), rates, time the estimates refer to
+    @ret: n/a
+"""
+def write_inferred(outfile_name, node_lst, src, dst, rates, time):
+    f = open(outfile_name, 'w+')
+    for node in node_lst:
+        f.write('%s,%s\n' % (node, node))
+    f.write('\n')
+    for u, v, r in zip(src.tolist(), dst.tolist(), rates.tolist()):
+        f.write('%s,%s,%f,%.10g\n' % (node_lst[u], node_lst[v], time, r))
+    f.close()
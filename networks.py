@@ -0,0 +1,197 @@
+"""
+networks.py
+Random directed network generators for the simulations. Each generator
+returns edge arrays (src, dst) directly, without building a networkx graph,
+and transmission rates for all edges are drawn in one call to gamma_rates.
+The rng arguments take a Generator or a RandomState (see streams.py).
+"""
+
+import numpy as np
+
+
+"""
+sample_pairs
+    Function to pick each of num_pairs slots independently with probability p
+    by geometric skipping: the gaps between picked slots are drawn in bulk, so
+    the cost is proportional to the number of picks rather than num_pairs.
+    @param: number of slots, p, rng - object with geometric (np.random by
+    default)
+    @ret: sorted array of picked slot indices
+"""
+def sample_pairs(num_pairs, p, rng=None):
+    if rng is None:
+        rng = np.random
+    if p <= 0 or num_pairs <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(num_pairs, dtype=np.int64)
+
+    expected = num_pairs * p
+    batch = int(expected + 5 * np.sqrt(expected) + 10)
+    picks = []
+    last = -1
+    while True:
+        pos = last + np.cumsum(rng.geometric(p, size=batch).astype(np.int64))
+        picks.append(pos[pos < num_pairs])
+        if pos[-1] >= num_pairs:
+            break
+        last = pos[-1]
+    return np.concatenate(picks)
+
+
+"""
+er_edges
+    Directed Erdos-Renyi graph without self loops.
+    @param: num_nodes, p - probability of each directed edge, rng
+    @ret: src and dst arrays
+"""
+def er_edges(num_nodes, p, rng=None):
+    k = sample_pairs(num_nodes * (num_nodes - 1), p, rng)
+    src = k // max(num_nodes - 1, 1)
+    dst = k % max(num_nodes - 1, 1)
+    # skip the diagonal
+    dst += dst >= src
+    return src, dst
+
+
+"""
+sbm_edges
+    Directed stochastic block model: nodes are split into consecutive blocks
+    and an edge from block a to block b appears with probability probs[a][b].
+    @param: list of block sizes, matrix of edge probabilities, rng
+    @ret: src and dst arrays
+"""
+def sbm_edges(sizes, probs, rng=None):
+    starts = np.concatenate(([0], np.cumsum(sizes)))
+    src = []
+    dst = []
+    for a in range(len(sizes)):
+        for b in range(len(sizes)):
+            if a == b:
+                s, d = er_edges(sizes[a], probs[a][b], rng)
+            else:
+                k = sample_pairs(sizes[a] * sizes[b], probs[a][b], rng)
+                s, d = k // sizes[b], k % sizes[b]
+            src.append(s + starts[a])
+            dst.append(d + starts[b])
+    return np.concatenate(src), np.concatenate(dst)
+
+
+"""
+small_world_edges
+    Directed Watts-Strogatz graph: every node links to its k nearest
+    neighbors on a ring (k // 2 on each side) and each link is rewired to a
+    uniformly random target with probability p. Rewired links that would
+    create self loops or repeat an edge are dropped.
+    @param: num_nodes, k, p, rng - object with uniform/choice
+    @ret: src and dst arrays
+"""
+def small_world_edges(num_nodes, k, p, rng=None):
+    if rng is None:
+        rng = np.random
+    half = k // 2
+    shifts = np.concatenate((np.arange(1, half + 1), -np.arange(1, half + 1)))
+    src = np.repeat(np.arange(num_nodes), len(shifts))
+    dst = (src + np.tile(shifts, num_nodes)) % num_nodes
+
+    rewire = rng.uniform(size=len(dst)) < p
+    dst[rewire] = rng.choice(num_nodes, np.sum(rewire))
+    keep = src != dst
+    return unique_edges(src[keep], dst[keep], num_nodes)
+
+
+"""
+scale_free_edges
+    Directed preferential attachment: every new node receives m edges from
+    existing nodes picked in proportion to their degree (by drawing uniformly
+    from the list of all edge endpoints so far), so early nodes become
+    high out-degree hubs.
+    @param: num_nodes, m - edges per new node, rng - object with uniform
+    @ret: src and dst arrays
+"""
+def scale_free_edges(num_nodes, m, rng=None):
+    if rng is None:
+        rng = np.random
+    num_edges = max(num_nodes - m, 0) * m
+    src = np.zeros(num_edges, dtype=np.int64)
+    dst = np.zeros(num_edges, dtype=np.int64)
+    # every edge endpoint so far, plus one slot per seed node
+    ends = np.zeros(2 * num_edges + m, dtype=np.int64)
+    ends[:m] = np.arange(m)
+    num_ends = m
+
+    uniform = rng.uniform(size=num_edges * 4 + 1)
+    u = 0
+    e = 0
+    for node in range(m, num_nodes):
+        chosen = set()
+        while len(chosen) < m:
+            if u == len(uniform):
+                uniform = rng.uniform(size=len(uniform))
+                u = 0
+            chosen.add(ends[int(uniform[u] * num_ends)])
+            u += 1
+        for parent in chosen:
+            src[e] = parent
+            dst[e] = node
+            e += 1
+        ends[num_ends:num_ends + m] = list(chosen)
+        ends[num_ends + m:num_ends + 2 * m] = node
+        num_ends += 2 * m
+
+    return src, dst
+
+
+"""
+network_edges
+    Function to draw the edges of a random graph of the given kind, with p
+    playing the role of each kind's probability:
+        'er' - Erdos-Renyi, p per directed edge
+        'sbm' - num_blocks blocks of (about) equal size, p per edge inside a
+        block and cross_prob (p / 10 by default) between blocks
+        'small_world' - ring of degree neighbors, each link rewired with
+        probability p
+        'scale_free' - preferential attachment, degree edges per new node
+    @param: kind, num_nodes, p, degree, num_blocks, cross_prob, rng
+    @ret: src and dst arrays
+"""
+def network_edges(kind, num_nodes, p, degree=4, num_blocks=2, cross_prob=None,
+        rng=None):
+    if kind == 'er':
+        return er_edges(num_nodes, p, rng)
+    if kind == 'sbm':
+        if cross_prob is None:
+            cross_prob = p / 10.
+        sizes = [len(block) for block in
+                np.array_split(np.arange(num_nodes), num_blocks)]
+        probs = np.where(np.eye(num_blocks, dtype=bool), p, cross_prob)
+        return sbm_edges(sizes, probs, rng)
+    if kind == 'small_world':
+        return small_world_edges(num_nodes, degree, p, rng)
+    if kind == 'scale_free':
+        return scale_free_edges(num_nodes, degree, rng)
+    raise ValueError('unknown network kind ' + str(kind))
+
+
+"""
+unique_edges
+    Drops repeated edges from edge arrays.
+    @param: src and dst arrays, num_nodes
+    @ret: sorted src and dst arrays without repeats
+"""
+def unique_edges(src, dst, num_nodes):
+    keys = np.unique(src.astype(np.int64) * num_nodes + dst)
+    return keys // num_nodes, keys % num_nodes
+
+
+"""
+gamma_rates
+    Draws a Gamma(a, b) transmission rate (b a rate, so the mean is a / b) for
+    every edge in one call.
+    @param: number of edges, a, b, rng
+    @ret: array of rates
+"""
+def gamma_rates(num_edges, a, b, rng=None):
+    if rng is None:
+        rng = np.random
+    return rng.gamma(a, 1. / b, size=num_edges)
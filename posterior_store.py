@@ -0,0 +1,217 @@
+"""
+posterior_store.py
+Persistent Gamma(alpha, beta) posterior for sequential updates. A store is a
+directory of .npy arrays: the node ids, the sorted edge keys
+(src_index * N + dst_index) and the per-edge alpha and beta. Each new InfoPath
+run is folded in through memory-mapped arrays, so only the touched edges are
+written, and named snapshots of the store can be taken and rolled back to.
+"""
+
+from update import (cached_read_infopath, edge_matrix, last_rates,
+        load_prior_sparse)
+import numpy as np
+
+import os
+import shutil
+
+# arrays making up a store
+STORE_FIELDS = ['nodes', 'keys', 'alpha', 'beta']
+
+
+"""
+create_store
+    Function to start a posterior store from a prior edge list.
+    @param: store directory, prior file name, alpha, beta - prior parameters
+    for every listed edge
+    @ret: n/a
+"""
+def create_store(path, priorname, alpha=1., beta=2.):
+    A, B = load_prior_sparse(priorname, alpha, beta)
+    A = A.tocoo()
+    B = B.tocoo()
+    num_nodes = A.shape[0]
+
+    keys = A.row.astype(np.int64) * num_nodes + A.col
+    write_store(path, np.arange(num_nodes, dtype=np.int64), keys, A.data,
+            B.data)
+
+
+"""
+write_store
+    Function to write every array of a store, sorted by edge key.
+    @param: store directory, node ids, edge keys, alpha, beta
+    @ret: n/a
+"""
+def write_store(path, nodes, keys, alpha, beta):
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    order = np.argsort(keys, kind='mergesort')
+    arrays = [np.asarray(nodes, dtype=np.int64), keys[order],
+            np.asarray(alpha, dtype=np.float64)[order],
+            np.asarray(beta, dtype=np.float64)[order]]
+
+    # every array is written to a temporary file first and renamed into place
+    # once all of them are on disk, so a crash while writing leaves the old
+    # store whole
+    fnames = [os.path.join(path, name + '.npy') for name in STORE_FIELDS]
+    for fname, arr in zip(fnames, arrays):
+        f = open(fname + '.tmp', 'wb')
+        np.save(f, arr)
+        f.close()
+    for fname in fnames:
+        os.rename(fname + '.tmp', fname)
+
+
+"""
+open_store
+    Function to open the arrays of a store as memory maps.
+    @param: store directory, mode - 'r' or 'r+' to update in place
+    @ret: dictionary (field -> array)
+"""
+def open_store(path, mode='r'):
+    return dict((name, np.load(os.path.join(path, name + '.npy'),
+        mmap_mode=mode)) for name in STORE_FIELDS)
+
+
+"""
+apply_infopath
+    Function to fold one InfoPath run into the store: every positive rate r
+    adds 1 to the edge's alpha and 1/r to its beta. Edges already in the store
+    are updated in place; edges seen for the first time enter with (1, 1/r),
+    which rewrites the whole store (see write_store) without touching the
+    old files until the new ones are written. Edges touching nodes outside
+    the store are skipped, so an empty store takes no edges.
+    @param: store directory, InfoPath file name
+    @ret: number of edges updated
+"""
+def apply_infopath(path, infoname):
+    node_names, src, dst, offsets, step_times, step_rates = \
+            cached_read_infopath(infoname)
+    rates = last_rates(offsets, step_rates)
+
+    store = open_store(path, 'r+')
+    nodes = store['nodes']
+    num_nodes = len(nodes)
+    if num_nodes == 0:
+        return 0
+
+    # map InfoPath node ids onto the store's node index
+    src_idx = np.minimum(np.searchsorted(nodes, src), num_nodes - 1)
+    dst_idx = np.minimum(np.searchsorted(nodes, dst), num_nodes - 1)
+    keep = ((rates > 0) & (nodes[src_idx] == src) & (nodes[dst_idx] == dst) &
+            (src_idx != dst_idx))
+
+    # the last line for a repeated edge wins
+    keys = (src_idx * num_nodes + dst_idx)[keep][::-1]
+    keys, first = np.unique(keys, return_index=True)
+    inv = 1. / rates[keep][::-1][first]
+
+    pos = np.minimum(np.searchsorted(store['keys'], keys),
+            max(len(store['keys']) - 1, 0))
+    found = np.zeros(len(keys), dtype=bool)
+    if len(store['keys']):
+        found = store['keys'][pos] == keys
+
+    if np.all(found):
+        store['alpha'][pos] += 1.
+        store['beta'][pos] += inv
+        store['alpha'].flush()
+        store['beta'].flush()
+        return len(keys)
+
+    # new edges: the updated arrays are built in memory and the maps are
+    # left as they are, so a failed rewrite can simply be run again
+    new = ~found
+    alpha = np.array(store['alpha'])
+    beta = np.array(store['beta'])
+    alpha[pos[found]] += 1.
+    beta[pos[found]] += inv[found]
+    arrays = [np.array(nodes), np.concatenate((store['keys'], keys[new])),
+            np.concatenate((alpha, np.ones(np.sum(new)))),
+            np.concatenate((beta, inv[new]))]
+    # release the maps before their files are replaced
+    del store, nodes
+    write_store(path, *arrays)
+    return len(keys)
+
+
+"""
+snapshot_store
+    Function to save a named copy of the store under path/snapshots.
+    @param: store directory, snapshot name
+    @ret: n/a
+"""
+def snapshot_store(path, name):
+    snapdir = os.path.join(path, 'snapshots', name)
+    if not os.path.exists(snapdir):
+        os.makedirs(snapdir)
+    for field in STORE_FIELDS:
+        shutil.copyfile(os.path.join(path, field + '.npy'),
+                os.path.join(snapdir, field + '.npy'))
+
+
+"""
+rollback_store
+    Function to restore the store to a named snapshot.
+    @param: store directory, snapshot name
+    @ret: n/a
+"""
+def rollback_store(path, name):
+    snapdir = os.path.join(path, 'snapshots', name)
+    if not os.path.exists(snapdir):
+        raise IOError('no snapshot named ' + name + ' in ' + path)
+    for field in STORE_FIELDS:
+        shutil.copyfile(os.path.join(snapdir, field + '.npy'),
+                os.path.join(path, field + '.npy'))
+
+
+"""
+store_edges
+    Function to read the posterior out of a store.
+    @param: store directory
+    @ret: arrays of src and dst node ids, alpha and beta
+"""
+def store_edges(path):
+    store = open_store(path)
+    nodes = np.asarray(store['nodes'])
+    keys = np.asarray(store['keys'])
+    return (nodes[keys // len(nodes)], nodes[keys % len(nodes)],
+            np.array(store['alpha']), np.array(store['beta']))
+
+
+"""
+store_to_sparse
+    Function to read a store as the N x N alpha and beta matrices
+    update.load_prior_sparse returns, N being the number of store nodes and
+    the matrices indexed by position in the store.
+    @param: store directory
+    @ret: N x N CSR matrices of alpha and beta
+"""
+def store_to_sparse(path):
+    store = open_store(path)
+    num_nodes = len(store['nodes'])
+    keys = np.asarray(store['keys'])
+    src = keys // num_nodes
+    dst = keys % num_nodes
+    return (edge_matrix(src, dst, store['alpha'], num_nodes),
+            edge_matrix(src, dst, store['beta'], num_nodes))
+
+
+"""
+store_to_graph
+    Function to convert a store into the graph returned by update.update.
+    @param: store directory
+    @ret: Networkx graph with (alpha, beta) in each edge's 'params'
+"""
+def store_to_graph(path):
+    import networkx as nx
+
+    src, dst, alpha, beta = store_edges(path)
+
+    G = nx.DiGraph()
+    G.add_nodes_from(np.asarray(open_store(path)['nodes']).tolist())
+    for u, v, a, b in zip(src.tolist(), dst.tolist(), alpha.tolist(),
+            beta.tolist()):
+        G.add_edge(u, v, params=(a, b))
+    return G
@@ -0,0 +1,190 @@
+"""
+prior.py
+Priors from genetic distance. Aligned sequences are compared block by block
+(utils' Hamming distance blocks, see pair_dist), and each block is cut down to
+the edges kept for the prior straight away, so the N x N distance matrix is
+never held. A pair is kept when it is among either sequence's k nearest
+neighbours and/or within a distance threshold, and kept pairs get an edge in
+both directions since the direction of transmission is unknown. That search
+still compares every pair; with a threshold, seqindex.near_pairs finds the
+same pairs through an index in about linear time instead, for outbreaks with
+tens of thousands of genomes.
+
+Every edge gets its own Gamma(alpha, beta) prior on the transmission rate.
+The shape is alpha for all of them and the rate grows with the distance d,
+    beta_e = beta * exp(d_e / scale),
+so the prior mean alpha / beta * exp(-d_e / scale) falls off with distance and
+identical sequences get the flat Gamma(alpha, beta) load_prior gives every
+listed edge. The prior is saved as a posterior store (see posterior_store.py)
+that update.load_prior_sparse, and so the update stage, reads directly, and
+that later InfoPath runs can be folded into.
+"""
+
+from posterior_store import write_store
+from seqindex import MAX_PAIRS, near_pairs
+from utils import onehot_block_dist, pack_sequences, packed_block_dist
+import numpy as np
+
+import csv
+
+# largest one-hot encoding of all the sequences kept in memory at once
+ONEHOT_BYTES = 2 ** 30
+
+
+"""
+read_fasta
+    Function to read aligned sequences from a FASTA file.
+    @param: file name
+    @ret: list of sequence names, (num_seqs x seq_len) array of single-character
+    bases
+"""
+def read_fasta(fname):
+    names = []
+    seqs = []
+    f = open(fname)
+    for l in f:
+        l = l.strip()
+        if not l:
+            continue
+        if l.startswith('>'):
+            names.append(l[1:].split()[0] if len(l) > 1 else '')
+            seqs.append([])
+        else:
+            seqs[-1].append(l)
+    f.close()
+
+    seqs = [''.join(parts) for parts in seqs]
+    if len(set(len(s) for s in seqs)) > 1:
+        raise ValueError('sequences in ' + fname + ' are not aligned')
+    seqarray = np.array(seqs, dtype=bytes).view('S1').reshape(len(seqs), -1)
+    return names, seqarray
+
+
+"""
+sparse_distances
+    Function to find the pairs of sequences kept for the prior and their
+    Hamming distances, one block of rows at a time.
+    @param: (num_seqs x seq_len) sequences, k - nearest neighbours kept per
+    sequence (None keeps all), threshold - largest distance kept (None keeps
+    all), block_size - rows per block, packed - use the 2-bit packed distance
+    (A/C/G/T only)
+    @ret: src and dst index arrays, in both directions and sorted by (src,
+    dst), and their distances
+"""
+def sparse_distances(seqarray, k=None, threshold=None, block_size=None,
+        packed=False):
+    if k is None and threshold is None:
+        raise ValueError('give k and/or a threshold so the prior is sparse')
+    if k is not None and k < 1:
+        raise ValueError('k must be at least 1')
+
+    seqarray = np.asarray(seqarray)
+    num_seqs = seqarray.shape[0]
+    if block_size is None:
+        block_size = 32 if packed else 256
+
+    if packed:
+        seqarray = pack_sequences(seqarray)
+        block_dist = packed_block_dist
+    else:
+        symbols = np.unique(seqarray)
+        seq_len = seqarray.shape[1]
+        dtype = np.float32 if seq_len < 2 ** 24 else np.float64
+        if seqarray.size * len(symbols) * np.dtype(dtype).itemsize <= \
+                ONEHOT_BYTES:
+            # encode every sequence once, so each block is a single product
+            seqarray = (seqarray[:,:,None] == symbols).reshape(num_seqs,
+                    -1).astype(dtype)
+            def block_dist(a, b):
+                return seq_len - np.dot(a, b.T)
+        else:
+            def block_dist(a, b):
+                return onehot_block_dist(a, b, symbols, dtype)
+
+    src = []
+    dst = []
+    dist = []
+    starts = range(0, num_seqs, block_size)
+    for i in starts:
+        rows = np.arange(i, min(i + block_size, num_seqs))
+        # one row block against every column block
+        d = np.empty((len(rows), num_seqs))
+        for j in starts:
+            d[:,j:j + block_size] = block_dist(seqarray[rows],
+                    seqarray[j:j + block_size])
+        d[np.arange(len(rows)), rows] = np.inf
+        if threshold is not None:
+            d[d > threshold] = np.inf
+
+        if k is not None and k < num_seqs - 1:
+            cols = np.argpartition(d, k - 1, axis=1)[:,:k]
+        else:
+            cols = np.tile(np.arange(num_seqs), (len(rows), 1))
+        vals = d[np.arange(len(rows))[:,None], cols]
+        keep = np.isfinite(vals)
+        src.append(np.repeat(rows, keep.sum(axis=1)))
+        dst.append(cols[keep])
+        dist.append(vals[keep])
+
+    src = np.concatenate(src).astype(np.int64)
+    dst = np.concatenate(dst).astype(np.int64)
+    dist = np.concatenate(dist)
+
+    # both directions of every kept pair
+    keys = np.concatenate((src * num_seqs + dst, dst * num_seqs + src))
+    keys, first = np.unique(keys, return_index=True)
+    dist = np.concatenate((dist, dist))[first]
+    return keys // num_seqs, keys % num_seqs, dist
+
+
+"""
+gamma_prior
+    Function to map distances onto Gamma(alpha, beta) priors, with beta
+    growing as beta * exp(d / scale).
+    @param: distances, alpha, beta - prior at distance 0, scale - distance at
+    which the prior mean falls by a factor e (the median positive distance by
+    default)
+    @ret: arrays of alpha and beta
+"""
+def gamma_prior(dist, alpha=1., beta=2., scale=None):
+    dist = np.asarray(dist, dtype=np.float64)
+    if scale is None:
+        positive = dist[dist > 0]
+        scale = float(np.median(positive)) if len(positive) else 1.
+    return (np.repeat(float(alpha), len(dist)),
+            beta * np.exp(dist / scale))
+
+
+"""
+build_prior
+    Function to build the prior of a set of aligned sequences and save it as
+    a store. Nodes are numbered 0..N-1 in sequence order.
+    @param: sequences, store directory, k, threshold (see sparse_distances),
+    alpha, beta, scale (see gamma_prior), packed, edgelist - also write the
+    u,v,prior mean edge list here (None to skip), index - find the pairs
+    within the threshold through seqindex instead of comparing every pair,
+    window, rng, max_pairs (see seqindex.near_pairs)
+    @ret: number of edges in the prior
+"""
+def build_prior(seqarray, path, k=10, threshold=None, alpha=1., beta=2.,
+        scale=None, packed=False, edgelist=None, index=False, window=64,
+        rng=None, max_pairs=MAX_PAIRS):
+    num_seqs = len(seqarray)
+    if index:
+        src, dst, dist = near_pairs(seqarray, threshold, k, window, rng,
+                max_pairs)
+    else:
+        src, dst, dist = sparse_distances(seqarray, k, threshold,
+                packed=packed)
+    prior_alpha, prior_beta = gamma_prior(dist, alpha, beta, scale)
+
+    write_store(path, np.arange(num_seqs, dtype=np.int64),
+            src * num_seqs + dst, prior_alpha, prior_beta)
+
+    if edgelist is not None:
+        w = open(edgelist, 'w+')
+        outcsv = csv.writer(w, delimiter=',', lineterminator='\n')
+        outcsv.writerows(zip(src.tolist(), dst.tolist(),
+            (prior_alpha / prior_beta).tolist()))
+        w.close()
+    return len(src)
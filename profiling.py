@@ -0,0 +1,277 @@
+"""
+profiling.py
+Per-stage timing and counters for the replicate pipeline. Code marks its
+stages with
+
+    with stage('update'):
+        ...
+
+(or the @timed('update') decorator) and bumps counters with
+count('edges_updated', n). Nothing is recorded until enable() is called, and
+while disabled stage() hands back one shared no-op context manager and count()
+returns straight away, so the marks can stay in the hot paths.
+
+enable() can also capture, per stage, a cProfile profile ('cprofile') or the
+peak memory allocated inside it ('memory', through tracemalloc, or the process
+peak RSS where tracemalloc is not available). State is per process: each pool
+worker records its own replicates.
+"""
+
+import json
+import os
+import sys
+import timeit
+
+# recording switch and capture mode (None, 'cprofile' or 'memory')
+ENABLED = False
+CAPTURE = None
+
+# stage name -> {'calls', 'seconds', 'peak_bytes'}
+STAGES = {}
+# counter name -> total
+COUNTERS = {}
+# stage name -> cProfile.Profile
+PROFILES = {}
+# stages currently open, innermost last
+OPEN = []
+
+
+"""
+NullStage
+    Context manager handed out while recording is disabled.
+"""
+class NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = NullStage()
+
+
+"""
+Stage
+    Context manager recording one pass through a stage.
+"""
+class Stage(object):
+    __slots__ = ('name', 'start', 'mem_start', 'child_peak', 'profile')
+
+    def __init__(self, name):
+        self.name = name
+        self.child_peak = 0
+        self.profile = None
+
+    def __enter__(self):
+        # cProfile allows a single active profiler, so only the outermost
+        # stage is profiled and it includes its inner stages
+        if CAPTURE == 'cprofile' and not OPEN:
+            import cProfile
+            self.profile = PROFILES.setdefault(self.name, cProfile.Profile())
+            self.profile.enable()
+        if CAPTURE == 'memory':
+            self.mem_start = memory_start()
+        OPEN.append(self)
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = timeit.default_timer() - self.start
+        OPEN.pop()
+        if self.profile is not None:
+            self.profile.disable()
+
+        record = STAGES.setdefault(self.name, {'calls': 0, 'seconds': 0.,
+            'peak_bytes': None})
+        record['calls'] += 1
+        record['seconds'] += elapsed
+
+        if CAPTURE == 'memory':
+            peak = max(memory_peak(self.mem_start), self.child_peak)
+            if OPEN:
+                OPEN[-1].child_peak = max(OPEN[-1].child_peak, peak)
+            record['peak_bytes'] = max(record['peak_bytes'] or 0, peak)
+        return False
+
+
+"""
+stage
+    Context manager timing the enclosed block as one call of a stage.
+    @param: stage name
+    @ret: context manager
+"""
+def stage(name):
+    if not ENABLED:
+        return NULL_STAGE
+    return Stage(name)
+
+
+"""
+timed
+    Decorator timing every call of a function as a stage.
+    @param: stage name (the function's name by default)
+    @ret: decorator
+"""
+def timed(name=None):
+    def decorate(fn):
+        stage_name = name or fn.__name__
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with Stage(stage_name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorate
+
+
+"""
+count
+    Adds to a counter.
+    @param: counter name, amount
+    @ret: n/a
+"""
+def count(name, n=1):
+    if ENABLED:
+        COUNTERS[name] = COUNTERS.get(name, 0) + n
+
+
+"""
+memory_start
+    Memory mark at the start of a stage: the traced size, after resetting the
+    traced peak where tracemalloc can, or 0 when the process peak RSS is used.
+"""
+def memory_start():
+    try:
+        import tracemalloc
+    except ImportError:
+        return 0
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    return tracemalloc.get_traced_memory()[0]
+
+"""
+memory_peak
+    Peak memory of a stage in bytes above its start mark.
+"""
+def memory_peak(start):
+    try:
+        import tracemalloc
+    except ImportError:
+        import resource
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return max(tracemalloc.get_traced_memory()[1] - start, 0)
+
+
+"""
+enable
+    Function to clear everything recorded so far and start recording.
+    @param: capture - None, 'cprofile' or 'memory'
+    @ret: n/a
+"""
+def enable(capture=None):
+    global ENABLED, CAPTURE
+    if capture not in (None, 'cprofile', 'memory'):
+        raise ValueError('unknown capture ' + str(capture))
+    reset()
+    ENABLED = True
+    CAPTURE = capture
+    if capture == 'memory':
+        try:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        except ImportError:
+            pass
+
+
+"""
+disable
+    Function to stop recording; what was recorded is kept until reset.
+"""
+def disable():
+    global ENABLED, CAPTURE
+    if CAPTURE == 'memory':
+        try:
+            import tracemalloc
+            tracemalloc.stop()
+        except ImportError:
+            pass
+    ENABLED = False
+    CAPTURE = None
+
+
+"""
+reset
+    Function to clear the recorded stages, counters and profiles.
+"""
+def reset():
+    STAGES.clear()
+    COUNTERS.clear()
+    PROFILES.clear()
+    del OPEN[:]
+
+
+"""
+report
+    Function to collect what was recorded.
+    @param: n/a
+    @ret: dictionary with 'stages' (name -> calls, seconds, peak_bytes) and
+    'counters' (name -> total)
+"""
+def report():
+    return {
+        'stages': dict((name, dict(record)) for name, record in
+            STAGES.items()),
+        'counters': dict(COUNTERS),
+    }
+
+
+"""
+write_report
+    Function to write the recorded report as JSON and, with cProfile capture,
+    one <prefix>_<stage>.prof stats file per profiled stage next to it (for
+    pstats or snakeviz).
+    @param: report file name
+    @ret: the report dictionary
+"""
+def write_report(outfile_name):
+    rep = report()
+    f = open(outfile_name, 'w')
+    json.dump(rep, f, indent=2, sort_keys=True)
+    f.close()
+
+    prefix = os.path.splitext(outfile_name)[0]
+    for name, profile in PROFILES.items():
+        profile.dump_stats(prefix + '_' + name + '.prof')
+    return rep
+
+
+"""
+gather_reports
+    Function to collect the reports written by write_report (by pool workers,
+    say) into one JSON list. Missing reports are skipped.
+    @param: list of (labels, report file name) pairs - labels is a dictionary
+    added to that report, outfile name
+    @ret: list of the labelled reports
+"""
+def gather_reports(named, outfile_name):
+    reports = []
+    for labels, fname in named:
+        if not os.path.exists(fname):
+            continue
+        f = open(fname)
+        rep = json.load(f)
+        f.close()
+        rep.update(labels)
+        reports.append(rep)
+
+    f = open(outfile_name, 'w')
+    json.dump(reports, f, indent=2, sort_keys=True)
+    f.close()
+    return reports
@@ -37,20 +37,25 @@ def compute_mae(inferred_file, updated_file, truth_file, priors_file, nodes_file
     print 'Prior MAE: ' + str(prior_mae)
 
 
-nodes_file = 'tb_data/tb-network.txt'
-truth_file = 'tb_data/tb-truth.txt'
-priors_file = 'tb_data/prior_edgelist_tb.txt'
+def main():
+    nodes_file = 'tb_data/tb-network.txt'
+    truth_file = 'tb_data/tb-truth.txt'
+    priors_file = 'tb_data/prior_edgelist_tb.txt'
 
-inferred_file = 'tb_data/tb_inferred.txt'
-updated_file = 'tb_data/tb-updated.txt'
-compute_mae(inferred_file, updated_file, truth_file, priors_file, nodes_file)
+    inferred_file = 'tb_data/tb_inferred.txt'
+    updated_file = 'tb_data/tb-updated.txt'
+    compute_mae(inferred_file, updated_file, truth_file, priors_file,
+            nodes_file)
 
+    """
+    nodes_file = 'sars_data/sars-network.txt'
+    truth_file = 'sars_data/sars-truth.txt'
 
-"""
-nodes_file = 'sars_data/sars-network.txt'
-truth_file = 'sars_data/sars-truth.txt'
+    inferred_file = 'sars_data/sars-inferred.txt'
+    updated_file = 'sars_data/sars-updated.txt'
+    compute_mae(inferred_file, updated_file, truth_file, nodes_file)
+    """
 
-inferred_file = 'sars_data/sars-inferred.txt'
-updated_file = 'sars_data/sars-updated.txt'
-compute_mae(inferred_file, updated_file, truth_file, nodes_file)
-"""
+
+if __name__ == "__main__":
+    main()
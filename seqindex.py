@@ -0,0 +1,193 @@
+"""
+seqindex.py
+Index for finding the pairs of aligned sequences within a Hamming distance
+cutoff without comparing every pair, for priors over tens of thousands of
+genomes (see prior.py). Only the variable sites are kept, and they are split
+at random into cutoff + 1 segments: two sequences that differ at no more than
+cutoff sites cannot differ in every segment, so they share at least one
+segment exactly. Sequences are bucketed by each segment's contents and only
+sequences sharing a bucket become candidates, which are then checked against
+the cutoff with their exact distance.
+
+A bucket's members are all paired with each other while the segment's
+candidates stay within a budget (max_pairs), taking the smallest buckets
+first, so the search is exact unless one or more buckets are too big for it
+(a large clonal cluster, say). Within those a sequence is only paired with the
+window members after it in sorted order, which says nothing about how close
+they are: pairs within the cutoff can then be missed, and a warning gives the
+number of buckets cut down this way. Time and memory stay bounded by about
+(cutoff + 1) * (max_pairs + num_seqs * window) candidates.
+"""
+
+from streams import make_rng
+import numpy as np
+
+import warnings
+
+# candidate pairs whose distances are computed at once
+CHUNK_PAIRS = 2 ** 16
+# candidate pairs per segment from buckets searched in full
+MAX_PAIRS = 2 ** 24
+
+
+"""
+sequence_codes
+    Function to turn sequences into one byte per base and keep only the sites
+    where they are not all the same.
+    @param: (num_seqs x seq_len) array of single-character (ASCII) bases or
+    of integer codes
+    @ret: (num_seqs x num_variable_sites) uint8 array
+"""
+def sequence_codes(seqarray):
+    seqarray = np.asarray(seqarray)
+    if seqarray.dtype.kind in 'iu':
+        codes = seqarray.astype(np.uint8)
+    elif seqarray.dtype.kind == 'U':
+        # one code point per base
+        codes = np.ascontiguousarray(seqarray, dtype='U1').view(
+                np.uint32).reshape(seqarray.shape).astype(np.uint8)
+    else:
+        codes = seqarray.astype('S1').view(np.uint8).reshape(seqarray.shape)
+    if not len(codes):
+        return codes
+    variable = np.any(codes != codes[0], axis=0)
+    return np.ascontiguousarray(codes[:,variable])
+
+
+"""
+row_ids
+    Ids of the distinct rows of a byte array, numbered in lexicographic order.
+    @param: (N x M) uint8 array
+    @ret: array of N ids
+"""
+def row_ids(codes):
+    codes = np.ascontiguousarray(codes)
+    if codes.shape[1] == 0:
+        return np.zeros(len(codes), dtype=np.int64)
+    rows = codes.view(np.dtype((np.void, codes.shape[1]))).ravel()
+    return np.unique(rows, return_inverse=True)[1].astype(np.int64)
+
+
+"""
+candidate_pairs
+    Function to list the pairs of sequences sharing a segment bucket. Buckets
+    are searched in full, smallest first, while the segment's pairs fit in
+    max_pairs; in the rest each sequence is paired with the next window
+    members only, and a warning says how many buckets that was.
+    @param: variable-site codes, cutoff, window - later bucket members each
+    sequence of a cut-down bucket is paired with, rng - random stream for the
+    segment split, max_pairs - pairs per segment from buckets searched in full
+    @ret: sorted unique keys i * num_seqs + j of the candidate pairs, i < j
+"""
+def candidate_pairs(codes, cutoff, window=64, rng=None, max_pairs=MAX_PAIRS):
+    rng = make_rng(rng)
+    num_seqs, num_sites = codes.shape
+
+    if cutoff >= num_sites:
+        # every pair is within the cutoff; one bucket holds them all
+        segments = [np.arange(0)]
+    else:
+        segments = np.array_split(rng.permutation(num_sites), cutoff + 1)
+    rank = row_ids(codes)
+
+    keys = np.zeros(0, dtype=np.int64)
+    truncated = 0
+    for seg in segments:
+        bucket = row_ids(codes[:,np.sort(seg)])
+        sizes = np.bincount(bucket, minlength=1)
+        pairs = sizes * (sizes - 1) // 2
+
+        # smallest buckets in full while they fit, the rest cut to window
+        by_pairs = np.argsort(pairs, kind='mergesort')
+        full = np.zeros(len(sizes), dtype=bool)
+        full[by_pairs[np.cumsum(pairs[by_pairs]) <= max_pairs]] = True
+        full |= sizes <= window + 1
+        truncated += np.count_nonzero(~full)
+        reach = np.where(full, sizes - 1, window)
+
+        # bucket by bucket, members in lexicographic order; member p of a
+        # bucket is paired with the next min(reach, size - 1 - p) members
+        order = np.lexsort((rank, bucket))
+        sorted_bucket = bucket[order]
+        starts = np.cumsum(sizes) - sizes
+        pos = np.arange(num_seqs)
+        after = sizes[sorted_bucket] - 1 - (pos - starts[sorted_bucket])
+        counts = np.minimum(after, reach[sorted_bucket])
+        step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                counts)
+        i = np.repeat(pos, counts)
+        i, j = order[i], order[i + 1 + step]
+        keys = np.union1d(keys, np.minimum(i, j) * num_seqs + np.maximum(i, j))
+
+    if truncated:
+        warnings.warn('%d segment buckets were too big to search in full; '
+                'pairs within the cutoff may be missed (raise max_pairs or '
+                'window)' % truncated)
+    return keys
+
+
+"""
+pair_hamming
+    Function to compute the Hamming distance of listed pairs only.
+    @param: variable-site codes, arrays of first and second sequence indices
+    @ret: distance array
+"""
+def pair_hamming(codes, src, dst):
+    dist = np.empty(len(src), dtype=np.int64)
+    for lo in range(0, len(src), CHUNK_PAIRS):
+        hi = lo + CHUNK_PAIRS
+        dist[lo:hi] = np.count_nonzero(codes[src[lo:hi]] != codes[dst[lo:hi]],
+                axis=1)
+    return dist
+
+
+"""
+near_pairs
+    Function to find the pairs of sequences within a Hamming distance cutoff
+    through the index, optionally keeping only each sequence's k nearest
+    (a pair stays when it is among either side's k), in the same form as
+    prior.sparse_distances so it can take its place.
+    @param: (num_seqs x seq_len) sequences, cutoff - largest distance kept,
+    k - nearest neighbours kept per sequence (None keeps all), window,
+    max_pairs (see candidate_pairs), rng - seed or random stream for the
+    segment split
+    @ret: src and dst index arrays, in both directions and sorted by (src,
+    dst), and their distances
+"""
+def near_pairs(seqarray, cutoff, k=None, window=64, rng=None,
+        max_pairs=MAX_PAIRS):
+    if cutoff is None or cutoff < 0:
+        raise ValueError('the index needs a distance cutoff of at least 0')
+    if k is not None and k < 1:
+        raise ValueError('k must be at least 1')
+
+    codes = sequence_codes(seqarray)
+    num_seqs = len(codes)
+    cutoff = int(cutoff)
+
+    keys = candidate_pairs(codes, cutoff, window, rng, max_pairs)
+    src = keys // max(num_seqs, 1)
+    dst = keys % max(num_seqs, 1)
+    dist = pair_hamming(codes, src, dst)
+    keep = dist <= cutoff
+    src, dst, dist = src[keep], dst[keep], dist[keep]
+
+    # both directions
+    src, dst = np.concatenate((src, dst)), np.concatenate((dst, src))
+    dist = np.concatenate((dist, dist)).astype(np.float64)
+
+    if k is not None:
+        # each sequence's k nearest, then every pair either side kept
+        order = np.lexsort((dst, dist, src))
+        src, dst, dist = src[order], dst[order], dist[order]
+        starts = np.searchsorted(src, src)
+        nearest = np.arange(len(src)) - starts < k
+        keys = np.union1d(src[nearest] * num_seqs + dst[nearest],
+                dst[nearest] * num_seqs + src[nearest])
+        lookup = src * num_seqs + dst
+        order = np.argsort(lookup)
+        dist = dist[order][np.searchsorted(lookup[order], keys)]
+        return keys // num_seqs, keys % num_seqs, dist
+
+    order = np.lexsort((dst, src))
+    return src[order], dst[order], dist[order]
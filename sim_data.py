@@ -6,82 +6,71 @@ used for the overall network inference algorithm.
 
 """
 
-from scipy import stats
+from cascades import cascades_to_times, read_cascade_text
+from netrate import infer_network, write_inferred
+from networks import er_edges
+from simrep import discrete_cascade
+from streams import make_rng, spawn_rngs
 from update import *
 from utils import *
+import numpy as np
 
 import csv
-import matplotlib.pyplot as plt
 import networkx as nx
 import os
-import random
 import subprocess
 
+# observation window of the simulated cascades
+CASCADE_MAX_TIME = 10
+
 
 """
 make_network
     Function that creates a random directed graph and assigns transmission rates
     to each edge based on a gamma distribution.
 
-    @param: a, b - parameters for gamma distribution
+    @param: a, b - parameters for gamma distribution, rng - random stream
+    (np.random by default, see streams.py)
     @ret: networkx graph G with transmission rates in 'trans_rate' attribute
 """
-def make_network(num_nodes, prob_edge_creation, a, b):
+def make_network(num_nodes, prob_edge_creation, a, b, rng=None):
+    if rng is None:
+        rng = np.random
+
     # create graph
-    # XXX see link below for addl random graphs
-    # http://networkx.lanl.gov/reference/generators.html#module-networkx.generators.random_graphs
-    G = nx.erdos_renyi_graph(num_nodes, prob_edge_creation, directed=True)
+    # XXX see networks.py for addl random graphs
+    src, dst = er_edges(num_nodes, prob_edge_creation, rng)
 
-    # assign transmission values per edge
-    for src,dest in G.edges():
-        trans_rate = stats.gamma.rvs(a, b)
-        G[src][dest]['trans_rate'] = trans_rate
+    # assign transmission values per edge; stats.gamma.rvs(a, b) took b as
+    # the location, so the rates are b + Gamma(a, 1)
+    trans_rate = b + rng.gamma(a, size=len(src))
 
+    G = nx.DiGraph()
+    G.add_nodes_from(range(num_nodes))
+    G.add_weighted_edges_from(zip(src.tolist(), dst.tolist(),
+        trans_rate.tolist()), weight='trans_rate')
     return G
 
 
 """
 make_cascade
     Function to simulate a cascade traversing a network based on the model used
-    in the NetRate and InfoPath papers.
+    in the NetRate and InfoPath papers, one integer time step at a time (see
+    simrep.discrete_cascade).
 
-    @param: networkx graph G with transmission rates as weights
+    @param: networkx graph G with transmission rates as weights, rng - random
+    stream (np.random by default)
     @ret: list of tuples (node_id, infection_time) that has at least one element
 """
-def make_cascade(G, max_time, show_vis, voter_model=False):
-    time_step = 0
+def make_cascade(G, max_time, show_vis, voter_model=False, rng=None):
+    if rng is None:
+        rng = np.random
 
     # initialization with randomly selected source node
-    src = random.choice(G.nodes())
-    infection_dict = {}
-    infection_dict[src] = time_step
-
-    # for vis-test purposes
-    cascade_edges = []
-
-    # XXX is there a better way to cut off the cascade creation process?
-    while time_step < max_time:
-        time_step += 1
-
-        # assuming any node can infect any neighboring node
-        for node in infection_dict.keys():
-            for n in G.neighbors(node):
-                if n in infection_dict:
-                    # already infected
-                    continue
-
-                if voter_model:
-                    prob_infection = G.degree(n)
-                else:
-                    # scale = 1/lambda
-                    trans_rate = G[node][n]['trans_rate']
-                    prob_infection = stats.expon.cdf(time_step,
-                        scale=1.0 / trans_rate)
-
-                if stats.uniform.rvs(0, 1) <= prob_infection:
-                    # infected!
-                    infection_dict[n] = time_step
-                    cascade_edges.append((node, n))
+    node_lst = list(G.nodes())
+    src = node_lst[rng.choice(len(node_lst))]
+    infection_dict, cascade_edges = discrete_cascade(G, src, max_time,
+            voter_model, rng)
 
     if show_vis:
         node_color = ['red' if node == src else '#ADD8E6' for node in G.nodes()]
@@ -165,20 +154,23 @@ make_infopath_input
     simulated dataset.
 
     @param: show_vis - boolean to show graphs depicting the network (only works
-    for small graphs!)
+    for small graphs!), rng - seed or random stream every draw is made from
     @ret: n/a
 """
-def make_infopath_input(dir_name, network_name, show_vis=False):
+def make_infopath_input(dir_name, network_name, show_vis=False, rng=None):
     # variables
     num_nodes = 10
     prob_edge_creation = 0.5
     alpha_param = 0.5
     beta_param = 0.5
     num_cascades = 10
-    cascade_max_time = 10
+    cascade_max_time = CASCADE_MAX_TIME
+
+    rng = make_rng(rng)
 
     # make_network
-    G = make_network(num_nodes, prob_edge_creation, alpha_param, beta_param)
+    G = make_network(num_nodes, prob_edge_creation, alpha_param, beta_param,
+            rng)
 
     if show_vis:
         # show regular graph
@@ -191,7 +183,8 @@ def make_infopath_input(dir_name, network_name, show_vis=False):
     for i in xrange(num_cascades):
         # XXX toggling between the voter_model
         voter_model = True
-        infection_lst = make_cascade(G, cascade_max_time, show_vis, voter_model)
+        infection_lst = make_cascade(G, cascade_max_time, show_vis, voter_model,
+                rng)
         cascade_dict[i] = infection_lst
 
     write_files(dir_name, network_name, cascade_dict, G)
@@ -207,6 +200,8 @@ print_graph
     @param: graph G, node_color, edge_color
 """
 def print_graph(G, node_color, edge_color):
+    import matplotlib.pyplot as plt
+
     edge_labels=dict([((u,v,),int(d['trans_rate']))
                  for u,v,d in G.edges(data=True)])
     pos=nx.spring_layout(G)
@@ -218,22 +213,18 @@ def print_graph(G, node_color, edge_color):
     plt.show()
 
 
-def update_wrapper(infoname, priorname, outname, outavgname):
-    G = update(infoname, priorname)
-    for e in G.edges():
-        print G[e[0]][e[1]]['params']
-        print e, stats.gamma(G[e[0]][e[1]]['params'][0], scale=G[e[0]][e[1]]['params'][1]).stats(moments='m')
-    nx.write_edgelist(G,outname)
-    A = G.copy()
-    for e in A.edges():
-        p = stats.gamma(G[e[0]][e[1]]['params'][0], scale=G[e[0]][e[1]]['params'][1]).stats(moments='m')
-#       if p == nan: A[e[0]][e[1]]['weight'] = 0
-        A[e[0]][e[1]]['weight'] = p
-    nx.write_weighted_edgelist(A,outavgname,delimiter=',')
-
+"""
+main
+    Function to run num_iter replicates, one directory each, and write their
+    MAEs to sim_rep_mae.csv.
 
-def main():
-    num_iter = 10
+    @param: num_iter, native - infer the network in-process with netrate
+    instead of running ./infopath, seed - seed the replicates' streams are
+    spawned from
+    @ret: n/a
+"""
+def main(num_iter=10, native=True, seed=0):
+    rngs = spawn_rngs(seed, num_iter)
 
     outcsv = csv.writer(open('sim_rep_mae.csv', 'w+'), delimiter=',',
             quoting = csv.QUOTE_NONE)
@@ -243,24 +234,34 @@ def main():
         # where the magic begins...
         dir_name = str(i)
         network_name = 'sim'
-        make_infopath_input(dir_name, network_name, show_vis=False)
+        make_infopath_input(dir_name, network_name, show_vis=False,
+                rng=rngs[i])
 
         cascade_file = dir_name + '/' + network_name + '_cascades.txt'
         network_file = dir_name + '/' + network_name + '_network.txt'
         infoname = dir_name + '/' + network_name + '_inferred'
 
-        # XXX running infopath
-        arg_lst = [
-            './infopath',
-            '-i:' + cascade_file,
-            '-n:' + network_file,
-            '-o:' + infoname,
-            '-ts:10',
-            '-it:0',
-            # '-tt:10',
-            '-s:0'
-        ]
-        subprocess.call(arg_lst)
+        if native:
+            # the cascades as InfoPath reads them, over the network's nodes
+            node_lst = nodes(network_file)
+            times = cascades_to_times(read_cascade_text(cascade_file)[1],
+                    node_lst)
+            src, dst, rates = infer_network(times, CASCADE_MAX_TIME)
+            write_inferred(infoname + '.txt', node_lst, src, dst, rates,
+                    CASCADE_MAX_TIME)
+        else:
+            # XXX running infopath
+            arg_lst = [
+                './infopath',
+                '-i:' + cascade_file,
+                '-n:' + network_file,
+                '-o:' + infoname,
+                '-ts:10',
+                '-it:0',
+                # '-tt:10',
+                '-s:0'
+            ]
+            subprocess.call(arg_lst)
 
         infoname = infoname + '.txt'
         priorname = dir_name + '/' + network_name + '_truth.txt'
@@ -1,59 +1,154 @@
 """
 sim_data.py
 File with functions related to creating/analyzing simulated network data to be
-used for the overall network inference algorithm.
+used for the overall network inference algorithm. Plotting (matplotlib,
+networkx) and the debugger are only imported when asked for, so pool workers
+start quickly and never wait on a window; pass --debug to drop into the
+debugger on an uncaught exception.
 """
 
-from scipy import stats
+from cascades import *
+from edgegraph import EdgeGraph
+from netrate import *
+from networks import *
+from streams import *
 from update import *
 from utils import *
 
 import csv
-import matplotlib.pyplot as plt
-import networkx as nx
+import heapq
+import multiprocessing
 import os
-import random
+import profiling
 import subprocess
-
 import sys
-from IPython.core import ultratb
-sys.excepthook = ultratb.FormattedTB(mode='Verbose',
-color_scheme='Linux', call_pdb=1)
 
 
 """
 make_network
     Function that creates a random directed graph and assigns transmission rates
     to each edge based on a gamma distribution.
-    @param: a, b - parameters for gamma distribution
-    @ret: networkx graph G with transmission rates in 'trans_rate' attribute
+    @param: a, b - parameters for gamma distribution, rng - random stream
+    (np.random by default, see streams.py), kind - 'er', 'sbm', 'small_world'
+    or 'scale_free', with prob_edge_creation, degree, num_blocks and
+    cross_prob as networks.network_edges reads them
+    @ret: EdgeGraph G with the transmission rates in G.rate
 """
-def make_network(num_nodes, prob_edge_creation, a, b):
+def make_network(num_nodes, prob_edge_creation, a, b, rng=None, kind='er',
+        degree=4, num_blocks=2, cross_prob=None):
     # create graph
-    # XXX see link below for addl random graphs
-    # http://networkx.lanl.gov/reference/generators.html#module-networkx.generators.random_graphs
-    G = nx.erdos_renyi_graph(num_nodes, prob_edge_creation, directed=True)
+    src, dst = network_edges(kind, num_nodes, prob_edge_creation, degree,
+            num_blocks, cross_prob, rng)
 
     # assign transmission values per edge
-    for src,dest in G.edges():
-        trans_rate = stats.gamma.rvs(a, scale=1./b)
-        G[src][dest]['trans_rate'] = trans_rate
+    trans_rate = gamma_rates(len(src), a, b, rng)
 
-    return G
+    return EdgeGraph.from_edges(range(num_nodes), src, dst, rate=trans_rate)
 
 
 """
 make_cascade
     Function to simulate a cascade traversing a network based on the model used
-    in the NetRate and InfoPath papers.
-    @param: networkx graph G with transmission rates as weights
+    in the NetRate and InfoPath papers. By default the cascade is simulated
+    event by event: every edge out of an infected node draws one exponential
+    transmission delay and nodes are infected in order of arrival time (a
+    Dijkstra-style search), giving exact continuous infection times in
+    O(E log V). The old per-timestep model is kept behind discrete=True so
+    earlier results can be reproduced.
+    @param: EdgeGraph G with transmission rates (a networkx graph with
+    'trans_rate' attributes is converted), max_time - observation window,
+    discrete - use the integer time-step simulation, rng - random stream
+    (np.random by default)
     @ret: list of tuples (node_id, infection_time) that has at least one element
 """
-def make_cascade(G, max_time, show_vis, voter_model=False):
-    time_step = 0
+def make_cascade(G, max_time, show_vis, voter_model=False, discrete=False,
+        rng=None):
+    if rng is None:
+        rng = np.random
+    if not isinstance(G, EdgeGraph):
+        G = EdgeGraph.from_networkx(G)
 
     # initialization with randomly selected source node
-    src = random.choice(G.nodes())
+    src = G.nodes[rng.choice(G.number_of_nodes())]
+
+    if discrete:
+        infection_dict, cascade_edges = discrete_cascade(G.to_networkx(), src,
+                max_time, voter_model, rng)
+    else:
+        infection_dict, cascade_edges = continuous_cascade(G, src, max_time,
+                voter_model, rng)
+    profiling.count('cascades')
+
+    if show_vis:
+        G = G.to_networkx()
+        node_color = ['red' if node == src else '#ADD8E6' for node in G.nodes()]
+        edge_color = ['red' if edge in cascade_edges else 'black' for edge in
+                G.edges()]
+        print_graph(G, node_color, edge_color)
+
+    return infection_dict.items()
+
+
+"""
+continuous_cascade
+    Event-driven cascade simulation. A heap holds the tentative infection time
+    of every node reached so far; popping it fixes the node's infection time
+    and draws a single Exp(rate) delay for each outgoing edge, all of the
+    node's edges in one call on its slice of the CSR arrays. Under the voter
+    model every edge has a unit delay, which reproduces the hop-by-hop spread
+    of the discrete model.
+    @param: EdgeGraph G, source node, max_time, voter_model, rng
+    @ret: dictionary (node_id -> infection_time), list of infecting edges
+"""
+def continuous_cascade(G, src, max_time, voter_model=False, rng=None):
+    if rng is None:
+        rng = np.random
+
+    # infection times by node index
+    infected = {}
+    cascade_edges = []
+
+    heap = [(0., G.index[src], -1)]
+    while heap:
+        time, i, parent = heapq.heappop(heap)
+        if i in infected:
+            # already infected through a faster path
+            continue
+        if time > max_time:
+            # everything left on the heap arrives after the cutoff
+            break
+
+        infected[i] = time
+        if parent >= 0:
+            cascade_edges.append((G.nodes[parent], G.nodes[i]))
+
+        lo = G.indptr[i]
+        hi = G.indptr[i + 1]
+        if voter_model:
+            delays = np.ones(hi - lo)
+        else:
+            delays = rng.standard_exponential(hi - lo) / G.rate[lo:hi]
+
+        for j, delay in zip(G.indices[lo:hi].tolist(), delays.tolist()):
+            if j not in infected:
+                heapq.heappush(heap, (time + delay, j, i))
+
+    infection_dict = dict((G.nodes[i], t) for i, t in infected.items())
+    return infection_dict, cascade_edges
+
+
+"""
+discrete_cascade
+    Original per-timestep cascade simulation: on every integer time step each
+    infected node tries to infect each uninfected neighbor.
+    @param: networkx graph G, source node, max_time, voter_model, rng
+    @ret: dictionary (node_id -> infection_time), list of infecting edges
+"""
+def discrete_cascade(G, src, max_time, voter_model=False, rng=None):
+    if rng is None:
+        rng = np.random
+    time_step = 0
+
     infection_dict = {}
     infection_dict[src] = time_step
 
@@ -74,23 +169,16 @@ def make_cascade(G, max_time, show_vis, voter_model=False):
                 if voter_model:
                     prob_infection = G.degree(n)
                 else:
-                    # scale = 1/lambda
+                    # Exp(trans_rate) cdf at time_step
                     trans_rate = G[node][n]['trans_rate']
-                    prob_infection = stats.expon.cdf(time_step,
-                        scale=1.0 / trans_rate)
+                    prob_infection = 1. - np.exp(-trans_rate * time_step)
 
-                if stats.uniform.rvs(0, 1) <= prob_infection:
+                if rng.uniform() <= prob_infection:
                     # infected!
                     infection_dict[n] = time_step
                     cascade_edges.append((node, n))
 
-    if show_vis:
-        node_color = ['red' if node == src else '#ADD8E6' for node in G.nodes()]
-        edge_color = ['red' if edge in cascade_edges else 'black' for edge in
-                G.edges()]
-        print_graph(G, node_color, edge_color)
-
-    return infection_dict.items()
+    return infection_dict, cascade_edges
 
 
 """
@@ -111,8 +199,7 @@ def cascades_to_file(outfile_name, cascade_dict):
     outcsv.writerow([])
 
     for key, lst in cascade_dict.iteritems():
-        lst_str = ",".join("%d,%d" % tup for tup in lst)
-        print lst
+        lst_str = ",".join("%d,%.10g" % tup for tup in lst)
 
         # lst_str = str(lst).strip('[]')
         outcsv.writerow([key, lst_str])
@@ -122,27 +209,28 @@ def cascades_to_file(outfile_name, cascade_dict):
 network_to_file
     Function to write the nodes of the network to the proper Infopath input
     format.
-    @param: outfile name, networkx graph G
+    @param: outfile name, EdgeGraph G
 """
 def network_to_file(network_file, truth_file, G):
     outcsv = csv.writer(open(network_file, 'w+'), delimiter=',')
 
     # print
-    for node in G.nodes():
+    for node in G.nodes:
         # node_id, node_name (same)
         outcsv.writerow([node, node])
 
     # also printing true network
     outcsv = csv.writer(open(truth_file, 'w+'), delimiter=',')
 
-    for src, dest in G.edges():
-        outcsv.writerow([src, dest, G[src][dest]['trans_rate']])
+    outcsv.writerows(G.edge_list('rate'))
 
 
 """
 write_files
-    Function to write all of the necessary files into a directory.
-    @param: network_name, cascade_dict (cascade_id -> lst), graph G
+    Function to write all of the necessary files into a directory. Cascades
+    are written both as InfoPath text and as a binary cascade file
+    (<name>_cascades.bin, see cascades.write_cascades).
+    @param: network_name, cascade_dict (cascade_id -> lst), EdgeGraph G
 """
 def write_files(dir_name, network_name, cascade_dict, G):
     if not os.path.exists(dir_name):
@@ -154,6 +242,8 @@ def write_files(dir_name, network_name, cascade_dict, G):
     readme.write(network_name)
 
     cascades_to_file(network_name + '_cascades.txt', cascade_dict)
+    offsets, nodes, times = cascades_to_csr(cascade_dict)
+    write_cascades(network_name + '_cascades.bin', offsets, nodes, times)
     network_to_file(network_name + '_network.txt', network_name + '_truth.txt', G)
 
 
@@ -162,39 +252,50 @@ make_infopath_input
     Function to create the proper file input for the InfoPath algorithm with a
     simulated dataset.
     @param: show_vis - boolean to show graphs depicting the network (only works
-    for small graphs!)
-    @ret: n/a
+    for small graphs!), then the network size and edge probability, the
+    gamma parameters of the rates, the number of cascades, their observation
+    window and whether they follow the voter model, rng - random stream
+    every draw is made from (np.random by default), network_kind, degree,
+    num_blocks, cross_prob - the random graph (see make_network)
+    @ret: list of node ids, (num_cascades x N) array of infection times (+inf
+    if never infected) and the cascade observation window
 """
-def make_infopath_input(dir_name, network_name, show_vis=False):
-    # variables
-    num_nodes = 10
-    prob_edge_creation = 0.5
-    alpha_param = 1.
-    beta_param = 2.
-    num_cascades = 10
-    cascade_max_time = 10
-
+def make_infopath_input(dir_name, network_name, show_vis=False, num_nodes=10,
+        prob_edge_creation=0.5, alpha_param=1., beta_param=2., num_cascades=10,
+        cascade_max_time=10, voter_model=True, rng=None, network_kind='er',
+        degree=4, num_blocks=2, cross_prob=None):
     # make_network
-    G = make_network(num_nodes, prob_edge_creation, alpha_param, beta_param)
+    with profiling.stage('make_network'):
+        G = make_network(num_nodes, prob_edge_creation, alpha_param,
+                beta_param, rng, network_kind, degree, num_blocks, cross_prob)
 
     if show_vis:
         # show regular graph
-        print_graph(G, '#ADD8E6', 'black')
+        print_graph(G.to_networkx(), '#ADD8E6', 'black')
 
     # convert to infopath file input
-    cascade_dict = {}
-
-    # given this network, create a cascade
-    for i in xrange(num_cascades):
-        # XXX toggling between the voter_model
-        voter_model = True
-        infection_lst = make_cascade(G, cascade_max_time, show_vis, voter_model)
-        cascade_dict[i] = infection_lst
-
-    write_files(dir_name, network_name, cascade_dict, G)
+    if show_vis:
+        # one cascade at a time so each one can be drawn
+        cascade_dict = {}
+        for i in xrange(num_cascades):
+            infection_lst = make_cascade(G, cascade_max_time, show_vis,
+                    voter_model, rng=rng)
+            cascade_dict[i] = infection_lst
+        node_lst = G.nodes
+        times = cascades_to_times(cascade_dict, node_lst)
+    else:
+        # given this network, create all of the cascades in one batch
+        with profiling.stage('make_cascades'):
+            node_lst, indptr, indices, rates = to_csr(G)
+            times = simulate_cascades(indptr, indices, rates, num_cascades,
+                    cascade_max_time, voter_model=voter_model, rng=rng)
+            cascade_dict = times_to_cascades(times, node_lst)
+
+    with profiling.stage('write_files'):
+        write_files(dir_name, network_name, cascade_dict, G)
 
     print 'Saved To: ' + network_name
-    return network_name
+    return node_lst, times, cascade_max_time
 
 
 """
@@ -203,6 +304,9 @@ print_graph
     @param: graph G, node_color, edge_color
 """
 def print_graph(G, node_color, edge_color):
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
     edge_labels=dict([((u,v,),int(d['trans_rate']))
                  for u,v,d in G.edges(data=True)])
     pos=nx.spring_layout(G)
@@ -214,83 +318,193 @@ def print_graph(G, node_color, edge_color):
     plt.show()
 
 
-def update_wrapper(infoname, priorname, outname, outavgname):
-    G = update(infoname, priorname)
-    for e in G.edges():
-        print G[e[0]][e[1]]['params']
-        print e, stats.gamma(G[e[0]][e[1]]['params'][0], scale=1./G[e[0]][e[1]]['params'][1]).stats(moments='m')
-    nx.write_edgelist(G,outname)
-    A = G.copy()
-    for e in A.edges():
-        p = stats.gamma(G[e[0]][e[1]]['params'][0], scale=1./G[e[0]][e[1]]['params'][1]).stats(moments='m')
-#       if p == nan: A[e[0]][e[1]]['weight'] = 0
-        A[e[0]][e[1]]['weight'] = p
-    nx.write_weighted_edgelist(A,outavgname,delimiter=',')
+"""
+run_replicate
+    Function to run one replicate of the simulation study in its own directory:
+    simulate data, run InfoPath, update the prior and score the three
+    estimates. The replicate's row is also saved to <dir>/sim_mae.csv so a
+    sweep that stops part way can be resumed, and with profiling on a
+    timing/memory report of its stages goes to <dir>/sim_profile.json.
+    @param: replicate index i, seed - int, SeedSequence or random stream
+    (see streams.py) every draw of the replicate comes from, resume - reuse
+    the saved row if the replicate already finished, native - infer the
+    network in-process with netrate instead of ./infopath, params -
+    dictionary of make_infopath_input settings, dir_name - directory of the
+    replicate (str(i) by default), profile - False, True (timings and
+    counters), 'cprofile' or 'memory' (see profiling.enable)
+    @ret: list [infopath_mae, algo_mae, prior_mae]
+"""
+def run_replicate(i, seed=None, resume=False, native=True, params=None,
+        dir_name=None, profile=False):
+    # where the magic begins...
+    if dir_name is None:
+        dir_name = str(i)
+    if params is None:
+        params = {}
+    network_name = 'sim'
+    rowname = dir_name + '/' + network_name + '_mae.csv'
 
+    if resume and os.path.exists(rowname):
+        return list(np.genfromtxt(rowname, delimiter=','))
 
-def main():
-    num_iter = 10
+    # each replicate gets its own stream no matter which worker runs it
+    rng = make_rng(seed)
 
-    w = open('sim_rep_mae.csv', 'w+')
-    outcsv = csv.writer(w, delimiter=',',
-            quoting = csv.QUOTE_NONE)
-    outcsv.writerow(['infopath_mae', 'algo_mae', 'prior_mae'])
+    if not profile:
+        return score_replicate(dir_name, network_name, native, params, rng)
 
-    for i in xrange(num_iter):
-        # where the magic begins...
-        dir_name = str(i)
-        network_name = 'sim'
-        make_infopath_input(dir_name, network_name, show_vis=False)
+    profiling.enable(None if profile is True else profile)
+    try:
+        with profiling.stage('replicate'):
+            row = score_replicate(dir_name, network_name, native, params,
+                    rng)
+        profiling.write_report(dir_name + '/' + network_name +
+                '_profile.json')
+    finally:
+        profiling.disable()
+    return row
 
-        cascade_file = dir_name + '/' + network_name + '_cascades.txt'
-        network_file = dir_name + '/' + network_name + '_network.txt'
-        infoname = dir_name + '/' + network_name + '_inferred'
 
+"""
+score_replicate
+    The body of run_replicate, with its stages marked for profiling.
+    @param: replicate directory, network name, native, params, rng
+    @ret: list [infopath_mae, algo_mae, prior_mae]
+"""
+def score_replicate(dir_name, network_name, native, params, rng):
+    rowname = dir_name + '/' + network_name + '_mae.csv'
+
+    node_lst, times, max_time = make_infopath_input(dir_name, network_name,
+            show_vis=False, rng=rng, **params)
+
+    cascade_file = dir_name + '/' + network_name + '_cascades.txt'
+    network_file = dir_name + '/' + network_name + '_network.txt'
+    infoname = dir_name + '/' + network_name + '_inferred'
+
+    if native:
+        with profiling.stage('infer_network'):
+            src, dst, rates = infer_network(times, max_time)
+            write_inferred(infoname + '.txt', node_lst, src, dst, rates,
+                    max_time)
+    else:
         # XXX running infopath
         arg_lst = [
             './infopath',
             '-i:' + cascade_file,
             '-n:' + network_file,
             '-o:' + infoname,
-            '-ts:0.5', '-it:0', '-tt:10', '-s:0'
+            '-ts:0.5', '-it:0', '-tt:' + str(max_time), '-s:0'
         ]
-        subprocess.call(arg_lst)
+        with profiling.stage('infopath'):
+            subprocess.call(arg_lst)
 
-        infoname = infoname + '.txt'
-        priorname = dir_name + '/' + network_name + '_truth.txt'
-        outname = dir_name + '/' + network_name + '_updated.txt'
-        outavgname = dir_name + '/' + network_name + '_updated_avg.txt'
+    infoname = infoname + '.txt'
+    priorname = dir_name + '/' + network_name + '_truth.txt'
+    outname = dir_name + '/' + network_name + '_updated.txt'
+    outavgname = dir_name + '/' + network_name + '_updated_avg.txt'
 
-        update_wrapper(infoname, priorname, outname, outavgname)
+    with profiling.stage('update_wrapper'):
+        update_wrapper(infoname, priorname, outname, outavgname,
+                verbose=False)
 
-        # calculating mae
-        node_names = nodes(cascade_file)
+    # calculating mae
+    node_names = node_lst
 
-        # mae for infopath
-        inferred = load_infopath(infoname)
-        inf_lst = [(e[0], e[1], inferred[e[0]][e[1]]['weight']) for e in
-                inferred.edges()]
+    # mae for infopath
+    with profiling.stage('load_infopath'):
+        inferred = load_infopath_graph(infoname)
+    inf_lst = inferred.edge_list('rate')
 
-        truth_lst = np.genfromtxt(priorname, delimiter=',')
+    truth_lst = np.genfromtxt(priorname, delimiter=',')
 
+    with profiling.stage('mae'):
         infopath_mae = mae(inf_lst, truth_lst, node_names)
 
-        # mae for new algo
-        updated_lst = np.genfromtxt(outavgname, delimiter=',')
+    # mae for new algo
+    updated_lst = np.genfromtxt(outavgname, delimiter=',')
 
+    with profiling.stage('mae'):
         algo_mae = mae(updated_lst, truth_lst, node_names)
 
-        # mae for prior net
-        prior_lst = np.copy(truth_lst)
-        prior_lst[:,2] = .5
+    # mae for prior net
+    prior_lst = np.copy(truth_lst)
+    prior_lst[:,2] = .5
+    with profiling.stage('mae'):
         prior_mae = mae(prior_lst,truth_lst,node_names)
 
-        outcsv.writerow([infopath_mae, algo_mae, prior_mae])
+    row = [infopath_mae, algo_mae, prior_mae]
+    outcsv = csv.writer(open(rowname, 'w+'), delimiter=',',
+            quoting = csv.QUOTE_NONE)
+    outcsv.writerow(row)
+
+    return row
+
 
+"""
+replicate_worker
+    Pool entry point; unpacks the (i, seed, resume, native, params, dir_name,
+    profile) task for run_replicate.
+"""
+def replicate_worker(task):
+    return run_replicate(*task)
+
+
+"""
+main
+    Function to run num_iter replicates across a process pool and collect their
+    rows into sim_rep_mae.csv in replicate order. With profiling on, the
+    replicates' stage reports are gathered into sim_rep_profile.json next to
+    it.
+    @param: num_iter, processes - pool size (None uses every core, 1 runs in
+    this process), seed - seed the replicates' streams are spawned from,
+    resume - skip replicates whose directory already has a saved row, native -
+    use the in-process netrate inference instead of ./infopath, profile - see
+    run_replicate
+    @ret: n/a
+"""
+def main(num_iter=10, processes=None, seed=0, resume=False, native=True,
+        profile=False):
+    rngs = spawn_rngs(seed, num_iter)
+    tasks = [(i, rngs[i], resume, native, None, None, profile)
+            for i in xrange(num_iter)]
+
+    if processes == 1:
+        rows = map(replicate_worker, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        rows = pool.map(replicate_worker, tasks)
+        pool.close()
+        pool.join()
+
+    w = open('sim_rep_mae.csv', 'w+')
+    outcsv = csv.writer(w, delimiter=',',
+            quoting = csv.QUOTE_NONE)
+    outcsv.writerow(['infopath_mae', 'algo_mae', 'prior_mae'])
+    for row in rows:
+        outcsv.writerow(row)
     w.close()
+
+    if profile:
+        profiling.gather_reports([({'replicate': i},
+            str(i) + '/sim_profile.json') for i in xrange(num_iter)],
+            'sim_rep_profile.json')
+
     results = np.genfromtxt('sim_rep_mae.csv', delimiter=',')
     print np.mean(results[1:], axis=0)
 
 
+"""
+install_debugger
+    Function to open the verbose IPython traceback and pdb on uncaught
+    exceptions, for interactive runs only.
+"""
+def install_debugger():
+    from IPython.core import ultratb
+    sys.excepthook = ultratb.FormattedTB(mode='Verbose',
+    color_scheme='Linux', call_pdb=1)
+
+
 if __name__ == "__main__":
+    if '--debug' in sys.argv[1:]:
+        install_debugger()
     main()
@@ -0,0 +1,70 @@
+"""
+streams.py
+Random number streams for the simulations. Every simulation entry point takes
+an rng argument, and each replicate gets its own stream spawned from one seed
+with numpy's SeedSequence: replicates run in parallel draw independent numbers
+whatever worker runs them, and a run can be repeated bit for bit. On numpy
+older than 1.17, which has neither Generator nor SeedSequence, the streams are
+RandomStates seeded from the seed and the replicate's key instead.
+
+Only methods shared by Generator and RandomState (uniform, choice,
+standard_exponential, gamma, geometric, permutation, ...) are drawn from, so
+either kind of stream can be passed anywhere.
+"""
+
+import numpy as np
+
+# numpy >= 1.17
+HAS_GENERATOR = hasattr(np.random, 'default_rng')
+
+
+"""
+is_rng
+    Whether an object is already a stream (Generator or RandomState).
+"""
+def is_rng(obj):
+    if HAS_GENERATOR and isinstance(obj, np.random.Generator):
+        return True
+    return isinstance(obj, np.random.RandomState)
+
+
+"""
+make_rng
+    Function to turn a seed into a stream.
+    @param: seed - None (fresh entropy), an int, a SeedSequence or a stream,
+    which is returned as is
+    @ret: Generator (RandomState on old numpy)
+"""
+def make_rng(seed=None):
+    if is_rng(seed):
+        return seed
+    if HAS_GENERATOR:
+        return np.random.default_rng(seed)
+    return np.random.RandomState(seed)
+
+
+"""
+stream
+    Function to get the stream of one task of a run, e.g. stream(seed, cell,
+    replicate). It is the same stream SeedSequence(seed).spawn would hand that
+    task, so it depends only on the seed and the key.
+    @param: run seed (an int), key - nonnegative ints naming the task
+    @ret: Generator (RandomState on old numpy)
+"""
+def stream(seed, *key):
+    if seed is None:
+        raise ValueError('streams need a fixed seed to be reproducible')
+    if HAS_GENERATOR:
+        return np.random.default_rng(np.random.SeedSequence(seed,
+            spawn_key=tuple(key)))
+    return np.random.RandomState([seed] + list(key))
+
+
+"""
+spawn_rngs
+    Function to spawn independent streams for num tasks.
+    @param: run seed, number of streams
+    @ret: list of streams
+"""
+def spawn_rngs(seed, num):
+    return [stream(seed, i) for i in range(num)]
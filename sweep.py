@@ -0,0 +1,231 @@
+"""
+sweep.py
+Parameter sweeps over the simulation study. A JSON config names the
+make_infopath_input settings to vary and how to pick the cells of the grid:
+
+    {
+        "grid": "cartesian",            (or "random" / "lhs")
+        "samples": 20,                  (cells drawn by random / lhs)
+        "replicates": 3,
+        "seed": 0,
+        "processes": null,              (pool size, null uses every core)
+        "dir": "sweep",                 (replicate directories go here)
+        "output": "sweep_results.csv",  (.parquet also works with pandas)
+        "profile": false,               (true, "cprofile" or "memory" also
+                                        write <output>_profile.json)
+        "params": {
+            "network_kind": ["er", "sbm", "small_world", "scale_free"],
+            "num_nodes": [10, 20, 50],
+            "num_cascades": {"min": 10, "max": 1000, "log": true, "int": true}
+        }
+    }
+
+A list gives the values of a parameter; a range ({"min", "max"}, optionally
+"log" and "int") can only be used by the random and Latin hypercube grids.
+network_kind picks the random graph (see simrep.make_network), so inference
+can be compared across graph families alongside degree, num_blocks and
+cross_prob.
+Every (cell, replicate) gets its own random stream spawned from the config
+seed (streams.stream(seed, cell, replicate)), so a sweep gives the same table
+whatever the pool size or scheduling order. The table's run_seed column is
+the config seed, the same in every row; with the cell and replicate columns
+it names the row's stream.
+"""
+
+from streams import make_rng, stream
+import numpy as np
+
+import csv
+import profiling
+import json
+import multiprocessing
+import os
+import sys
+
+# columns of the results table after the parameters
+METRICS = ['infopath_mae', 'algo_mae', 'prior_mae']
+
+
+"""
+load_config
+    Function to read a sweep config and fill in its defaults.
+    @param: config file name
+    @ret: config dictionary
+"""
+def load_config(fname):
+    f = open(fname)
+    config = json.load(f)
+    f.close()
+
+    defaults = {
+        'grid': 'cartesian',
+        'samples': 10,
+        'replicates': 1,
+        'seed': 0,
+        'processes': None,
+        'dir': 'sweep',
+        'output': 'sweep_results.csv',
+        'native': True,
+        'resume': False,
+        'profile': False,
+    }
+    for key, value in defaults.items():
+        config.setdefault(key, value)
+    return config
+
+
+"""
+make_grid
+    Function to list the parameter settings of every cell.
+    @param: params from the config, kind - 'cartesian', 'random' or 'lhs',
+    number of cells to draw for random/lhs, rng - object with
+    uniform/permutation
+    @ret: list of dictionaries (parameter -> value), sorted keys
+"""
+def make_grid(params, kind='cartesian', samples=10, rng=None):
+    if rng is None:
+        rng = np.random
+    names = sorted(params.keys())
+
+    if kind == 'cartesian':
+        for name in names:
+            if not isinstance(params[name], list):
+                raise ValueError('cartesian grids need a list of values for '
+                        + name)
+        cells = [{}]
+        for name in names:
+            cells = [dict(cell, **{name: value}) for cell in cells
+                    for value in params[name]]
+        return cells
+
+    if kind == 'random':
+        u = rng.uniform(size=(samples, len(names)))
+    elif kind == 'lhs':
+        # one draw from each of the samples strata of every dimension, with
+        # the strata shuffled independently per dimension
+        u = np.empty((samples, len(names)))
+        for j in range(len(names)):
+            strata = rng.permutation(samples)
+            u[:,j] = (strata + rng.uniform(size=samples)) / samples
+    else:
+        raise ValueError('unknown grid ' + str(kind))
+
+    cells = []
+    for row in u:
+        cells.append(dict((name, scale_value(params[name], x))
+            for name, x in zip(names, row)))
+    return cells
+
+
+"""
+scale_value
+    Maps a uniform draw in [0, 1) onto a parameter's list or range.
+    @param: list of values or {"min", "max", "log", "int"} range, draw
+    @ret: parameter value
+"""
+def scale_value(spec, x):
+    if isinstance(spec, list):
+        return spec[min(int(x * len(spec)), len(spec) - 1)]
+
+    lo = float(spec['min'])
+    hi = float(spec['max'])
+    if spec.get('log', False):
+        value = np.exp(np.log(lo) + x * (np.log(hi) - np.log(lo)))
+    else:
+        value = lo + x * (hi - lo)
+    if spec.get('int', False):
+        return int(min(np.floor(value), hi))
+    return float(value)
+
+
+"""
+run_cell
+    Pool entry point; runs one replicate of one cell in
+    <dir>/<cell>_<replicate>.
+    @param: (cell index, replicate, parameters, config) task
+    @ret: (cell index, replicate, parameters, metrics) tuple
+"""
+def run_cell(task):
+    # imported here so the pool's workers pay for it, not load_config users
+    from simrep import run_replicate
+
+    cell, replicate, params, config = task
+    dir_name = os.path.join(config['dir'], '%d_%d' % (cell, replicate))
+    rng = stream(config['seed'], cell, replicate)
+    row = run_replicate(cell, rng, config['resume'], config['native'],
+            params, dir_name, config['profile'])
+    return cell, replicate, params, row
+
+
+"""
+run_sweep
+    Function to run every replicate of every cell across a process pool and
+    write one tidy table: one row per (cell, replicate) with its parameters,
+    the run seed and metrics. The row's random stream is
+    streams.stream(run_seed, cell, replicate).
+    @param: config dictionary
+    @ret: list of result rows (dictionaries)
+"""
+def run_sweep(config):
+    cells = make_grid(config['params'], config['grid'], config['samples'],
+            make_rng(config['seed']))
+
+    tasks = [(c, r, params, config) for c, params in enumerate(cells)
+            for r in range(config['replicates'])]
+
+    if config['processes'] == 1:
+        results = [run_cell(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(config['processes'])
+        results = pool.map(run_cell, tasks)
+        pool.close()
+        pool.join()
+
+    rows = []
+    for cell, replicate, params, metrics in sorted(results,
+            key=lambda res: (res[0], res[1])):
+        row = dict(params)
+        row.update({'cell': cell, 'replicate': replicate,
+            'run_seed': config['seed']})
+        row.update(zip(METRICS, metrics))
+        rows.append(row)
+
+    write_results(config['output'], rows, sorted(config['params'].keys()))
+
+    if config['profile']:
+        profiling.gather_reports([({'cell': c, 'replicate': r},
+            os.path.join(config['dir'], '%d_%d' % (c, r), 'sim_profile.json'))
+            for c, r in sorted((res[0], res[1]) for res in results)],
+            os.path.splitext(config['output'])[0] + '_profile.json')
+    return rows
+
+
+"""
+write_results
+    Function to write the sweep table as CSV, or as parquet through pandas
+    when the file name ends in .parquet.
+    @param: outfile name, result rows, parameter names
+    @ret: n/a
+"""
+def write_results(outfile_name, rows, param_names):
+    columns = ['cell', 'replicate', 'run_seed'] + param_names + METRICS
+
+    if outfile_name.endswith('.parquet'):
+        import pandas as pd
+        pd.DataFrame(rows, columns=columns).to_parquet(outfile_name)
+        return
+
+    w = open(outfile_name, 'w+')
+    outcsv = csv.writer(w, delimiter=',', lineterminator='\n')
+    outcsv.writerow(columns)
+    for row in rows:
+        outcsv.writerow([row[name] for name in columns])
+    w.close()
+
+
+def main():
+    run_sweep(load_config(sys.argv[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+temporal.py
+Time-resolved InfoPath estimates. Every per-timestep rate of an InfoPath run
+is kept in a dense (T x E) array so windows, decay weightings and per-step
+posterior updates are array operations rather than re-parses of the text.
+"""
+
+from update import cached_read_infopath
+import numpy as np
+
+
+"""
+load_time_steps
+    Function to load the time steps InfoPath writes next to its network
+    (fname[:-4]+'-time-steps.txt', one time per line).
+    @param: InfoPath network file name
+    @ret: sorted array of step times
+"""
+def load_time_steps(fname):
+    steps = np.loadtxt(fname[:-4] + '-time-steps.txt', ndmin=1)
+    return np.sort(steps)
+
+
+"""
+load_rate_tensor
+    Function to load every per-timestep rate of an InfoPath network. Rates are
+    placed at the step whose time matches their own; steps an edge has no
+    estimate for are 0, and a rate without a time (src,dst,rate lines) goes to
+    the last step.
+    @param: InfoPath network file name, steps - step times (read from the
+    time-steps companion file by default)
+    @ret: step times (T), edge src and dst arrays (E), (T x E) float32 rates
+"""
+def load_rate_tensor(fname, steps=None):
+    if steps is None:
+        steps = load_time_steps(fname)
+    steps = np.asarray(steps, dtype=np.float64)
+
+    node_names, src, dst, offsets, step_times, step_rates = \
+            cached_read_infopath(fname)
+
+    # one column per edge, the last line for a repeated edge wins
+    width = np.max(dst) + 1 if len(dst) else 1
+    keys = (src * width + dst)[::-1]
+    first = np.unique(keys, return_index=True)[1]
+    lines = len(src) - 1 - first
+    src = src[lines]
+    dst = dst[lines]
+
+    line_column = np.empty(len(offsets) - 1, dtype=np.int64)
+    line_column.fill(-1)
+    line_column[lines] = np.arange(len(lines))
+    step_column = np.repeat(line_column, np.diff(offsets))
+
+    # nearest step time, nan times go to the last step
+    row = np.searchsorted(steps, step_times)
+    row = np.clip(row, 0, len(steps) - 1)
+    prev = np.clip(row - 1, 0, len(steps) - 1)
+    with np.errstate(invalid='ignore'):
+        closer = (np.abs(step_times - steps[prev]) <
+                np.abs(step_times - steps[row]))
+    row[closer] = prev[closer]
+    row[np.isnan(step_times)] = len(steps) - 1
+
+    rates = np.zeros((len(steps), len(src)), dtype=np.float32)
+    keep = step_column >= 0
+    rates[row[keep], step_column[keep]] = step_rates[keep]
+
+    return steps, src, dst, rates
+
+
+"""
+window_means
+    Mean rate of every edge over each time window, from one cumulative sum.
+    @param: step times, (T x E) rates, list of (start, end) windows (both
+    ends inclusive)
+    @ret: (W x E) array of means, nan for a window holding no steps
+"""
+def window_means(steps, rates, windows):
+    windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+    cum = np.zeros((rates.shape[0] + 1, rates.shape[1]))
+    np.cumsum(rates, axis=0, out=cum[1:])
+
+    lo = np.searchsorted(steps, windows[:,0], side='left')
+    hi = np.searchsorted(steps, windows[:,1], side='right')
+    num_steps = (hi - lo).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (cum[hi] - cum[lo]) / num_steps[:,None]
+
+
+"""
+decay_mean
+    Exponentially decayed mean rate of every edge, weighting the step at time
+    t by exp(-(at - t) / tau). Steps after at are ignored.
+    @param: step times, (T x E) rates, tau - decay time scale, at - reference
+    time (the last step by default)
+    @ret: array of E weighted means
+"""
+def decay_mean(steps, rates, tau, at=None):
+    if at is None:
+        at = steps[-1]
+    weights = np.exp(-(at - steps) / float(tau))
+    weights[steps > at] = 0.
+    return np.dot(weights, rates) / np.sum(weights)
+
+
+"""
+step_posteriors
+    Conjugate Gamma update applied step by step: every positive rate r of an
+    edge adds 1 to alpha and 1/r to beta, so row k holds the posterior after
+    the first k+1 steps. Columns cover the prior edges and the InfoPath edges
+    (self loops and nodes outside the prior's 0..N-1 are dropped, as in
+    update.edge_matrix); an InfoPath-only edge stays at (0, 0) until its
+    first positive rate.
+    @param: N x N sparse prior alpha and beta, edge src and dst arrays, (T x E)
+    rates
+    @ret: src and dst of the U columns, (T x U) posterior alpha and beta
+"""
+def step_posteriors(A, B, src, dst, rates):
+    num_nodes = A.shape[0]
+    A = A.tocsr()
+    A.sum_duplicates()
+    B = B.tocsr()
+    B.sum_duplicates()
+    A = A.tocoo()
+    B = B.tocoo()
+
+    keep = ((src != dst) & (src >= 0) & (src < num_nodes) & (dst >= 0) &
+            (dst < num_nodes))
+    src = src[keep]
+    dst = dst[keep]
+    rates = np.asarray(rates, dtype=np.float64)[:,keep]
+
+    prior_keys = A.row.astype(np.int64) * num_nodes + A.col
+    info_keys = src.astype(np.int64) * num_nodes + dst
+    keys = np.union1d(prior_keys, info_keys)
+
+    alpha = np.zeros((rates.shape[0], len(keys)))
+    beta = np.zeros((rates.shape[0], len(keys)))
+    alpha[:, np.searchsorted(keys, prior_keys)] = A.data
+    beta[:, np.searchsorted(keys, prior_keys)] = B.data
+
+    observed = rates > 0
+    inv = np.zeros(rates.shape)
+    inv[observed] = 1. / rates[observed]
+    # repeated info keys were already collapsed by load_rate_tensor
+    cols = np.searchsorted(keys, info_keys)
+    alpha[:, cols] += np.cumsum(observed, axis=0)
+    beta[:, cols] += np.cumsum(inv, axis=0)
+
+    return keys // num_nodes, keys % num_nodes, alpha, beta
@@ -0,0 +1,59 @@
+"""
+test_cli.py
+Runs the batch manifest documented in cli.py on the bundled TB data, from a
+scratch directory so the outputs stay out of the tree.
+
+    python -m unittest test_cli
+"""
+
+import cli
+import numpy as np
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, 'tb_data'))
+        for name in ['tb_inferred.txt', 'prior_edgelist_tb.txt']:
+            shutil.copy(os.path.join('tb_data', name),
+                    os.path.join(self.root, 'tb_data', name))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_documented_manifest(self):
+        manifest = {
+            'output': 'batch_results.csv',
+            'keep_going': False,
+            'defaults': {'score': {'prior_rate': 0.5}},
+            'jobs': [
+                {'label': 'tb', 'command': 'update',
+                 'inferred': 'tb_data/tb_inferred.txt',
+                 'prior': 'tb_data/prior_edgelist_tb.txt'},
+            ]
+        }
+        fname = os.path.join(self.root, 'nightly.json')
+        f = open(fname, 'w')
+        json.dump(manifest, f)
+        f.close()
+
+        rows = cli.run_batch(fname)
+        self.assertEqual([row['status'] for row in rows], ['ok'])
+        self.assertTrue(os.path.exists(os.path.join(self.root,
+            'batch_results.csv')))
+
+        # the posterior means cover the space-separated prior's edges
+        avg = np.loadtxt(rows[0]['out_avg'], delimiter=',', ndmin=2)
+        self.assertGreater(len(avg), 0)
+        self.assertTrue(np.all(np.isfinite(avg[:,2])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+test_seqindex.py
+Checks of the sequence index (seqindex.near_pairs) against the all-pairs
+search of prior.sparse_distances. The test sequences are a few clonal
+clusters, so the segment buckets hold far more than window sequences.
+
+    python -m unittest test_seqindex
+"""
+
+from prior import sparse_distances
+from seqindex import candidate_pairs, near_pairs, sequence_codes
+import numpy as np
+
+import unittest
+import warnings
+
+
+"""
+clonal_sequences
+    Function to draw sequences from a few ancestors with a handful of
+    mutations each.
+    @param: number of sequences, sequence length, number of ancestors, largest
+    number of mutations per sequence, seed
+    @ret: (num_seqs x seq_len) array of single-character bases
+"""
+def clonal_sequences(num_seqs=300, seq_len=2000, num_clones=3, mutations=4,
+        seed=0):
+    rng = np.random.RandomState(seed)
+    bases = np.array(list('ACGT'), dtype='S1')
+    ancestors = rng.randint(4, size=(num_clones, seq_len))
+    codes = ancestors[rng.randint(num_clones, size=num_seqs)]
+    for row in codes:
+        sites = rng.randint(seq_len, size=rng.randint(mutations + 1))
+        row[sites] = rng.randint(4, size=len(sites))
+    return bases[codes]
+
+
+"""
+kth_nearest
+    Function to get every sequence's k-th nearest distance from a pair list.
+    @param: src, dst and distance arrays, number of sequences, k
+    @ret: array of distances, +inf for sequences with fewer than k pairs
+"""
+def kth_nearest(pairs, num_seqs, k):
+    src, dst, dist = pairs
+    kth = np.empty(num_seqs)
+    kth.fill(np.inf)
+    for i in range(num_seqs):
+        d = np.sort(dist[src == i])
+        if len(d) >= k:
+            kth[i] = d[k - 1]
+    return kth
+
+
+class NearPairsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.seqs = clonal_sequences()
+
+    def test_large_buckets(self):
+        # the clusters put most sequences in a few buckets, well past window
+        cutoff = 3
+        window = 4
+        codes = sequence_codes(self.seqs)
+        num_seqs = len(codes)
+        keys = candidate_pairs(codes, cutoff, window, rng=0)
+        self.assertGreater(len(keys), num_seqs * window * (cutoff + 1))
+
+    def test_threshold_recall(self):
+        for cutoff in [0, 3, 6]:
+            exact = sparse_distances(self.seqs, threshold=cutoff)
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                found = near_pairs(self.seqs, cutoff, window=4, rng=1)
+            for a, b in zip(exact, found):
+                np.testing.assert_array_equal(a, b)
+
+    def test_knn_recall(self):
+        k = 5
+        cutoff = 6
+        exact = sparse_distances(self.seqs, k=k, threshold=cutoff)
+        found = near_pairs(self.seqs, cutoff, k, window=4, rng=2)
+
+        # same k-th nearest distance for every sequence (ties may differ)
+        num_seqs = len(self.seqs)
+        np.testing.assert_array_equal(kth_nearest(found, num_seqs, k),
+                kth_nearest(exact, num_seqs, k))
+
+    def test_truncation_warns(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            near_pairs(self.seqs, 3, window=4, rng=0, max_pairs=100)
+        self.assertTrue(any('too big to search in full' in str(w.message)
+            for w in caught))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,17 +1,19 @@
 """
 update.py
 Takes in weighted network file produced by InfoPath, returns network
- with updated transmission rate distributions.
+ with updated transmission rate distributions. networkx is only imported by
+ the functions that return networkx graphs.
 """
 
-from scipy import stats
+from scipy.sparse import coo_matrix
+from scipy.special import gammaincinv
+from edgegraph import EdgeGraph
 import numpy as np
 
 import csv
-import matplotlib.pyplot as plt
-import networkx as nx
-import random
-import itertools
+import hashlib
+import os
+import profiling
 
 """
 load_infopath
@@ -20,29 +22,231 @@ load_infopath
     @ret: weighted Networkx graph
 """
 def load_infopath(fname):
-    # Load infopath output lines
-    f = open(fname, 'rU')
-    lines = [l for l in f]
+    return load_infopath_graph(fname).to_networkx(rate='weight')
+
+
+"""
+load_infopath_graph
+    Function to load the network generated by InfoPath as an EdgeGraph: the
+    listed nodes plus any other edge endpoints, and the last estimated rate
+    of every edge with a positive estimate.
+    @param: file name
+    @ret: EdgeGraph with the rates in rate
+"""
+def load_infopath_graph(fname):
+    node_names, src, dst, offsets, step_times, step_rates = \
+            cached_read_infopath(fname)
+    rates = last_rates(offsets, step_rates)
+
+    keep = rates > 0
+    return EdgeGraph.from_labeled_edges(node_names.tolist(), src[keep],
+            dst[keep], rate=rates[keep])
+
+
+"""
+write_infopath_avg
+    Function to export the InfoPath network as a weighted edge list next to
+    the InfoPath file (fname[:-4]+'_avg.txt'), as used for plotting.
+    @param: file name
+    @ret: name of the written file
+"""
+def write_infopath_avg(fname):
+    import networkx as nx
+
+    G = load_infopath(fname)
+    outname = fname[:-4]+'_avg.txt'
+    nx.write_weighted_edgelist(G, outname)
+    return outname
+
+
+# parsed InfoPath files, keyed by (path, size, mtime)
+INFOPATH_CACHE = {}
+# names of the read_infopath arrays in the .npz cache
+INFOPATH_FIELDS = ['node_names', 'src', 'dst', 'offsets', 'step_times',
+        'step_rates']
+
+"""
+cached_read_infopath
+    read_infopath with a two-level cache. Parsed arrays are kept in memory for
+    the life of the process and saved to fname[:-4]+'_cache.npz' together
+    with the source's size, mtime and SHA-1. The .npz is used when size and
+    mtime still match, or when only the mtime changed but the content hash is
+    the same; otherwise the file is parsed again and the .npz rewritten.
+    @param: file name
+    @ret: same arrays as read_infopath
+"""
+def cached_read_infopath(fname):
+    path = os.path.abspath(fname)
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    if key in INFOPATH_CACHE:
+        return INFOPATH_CACHE[key]
+
+    cachename = path[:-4] + '_cache.npz'
+    arrays = None
+    digest = None
+    fresh = False
+    if os.path.exists(cachename):
+        try:
+            cache = np.load(cachename)
+            meta = cache['meta']
+            if meta[0] == stat.st_size:
+                fresh = meta[1] == stat.st_mtime
+                if not fresh:
+                    digest = file_digest(path)
+                if fresh or digest == str(cache['digest']):
+                    arrays = tuple(cache[name] for name in INFOPATH_FIELDS)
+            cache.close()
+        except (IOError, KeyError, ValueError):
+            arrays = None
+            fresh = False
+
+    if arrays is None:
+        arrays = read_infopath(path)
+    if not fresh:
+        # new parse, or same content under a new mtime
+        if digest is None:
+            digest = file_digest(path)
+        try:
+            np.savez(cachename,
+                    meta=np.array([stat.st_size, stat.st_mtime]),
+                    digest=np.array(digest),
+                    **dict(zip(INFOPATH_FIELDS, arrays)))
+        except (IOError, OSError):
+            # read-only data directory, keep the in-memory copy only
+            pass
+
+    INFOPATH_CACHE[key] = arrays
+    return arrays
+
+"""
+file_digest
+    SHA-1 of a file's contents, read in blocks.
+"""
+def file_digest(fname):
+    h = hashlib.sha1()
+    f = open(fname, 'rb')
+    block = f.read(2 ** 20)
+    while block:
+        h.update(block)
+        block = f.read(2 ** 20)
+    f.close()
+    return h.hexdigest()
+
+
+"""
+read_infopath
+    Function to parse an InfoPath output file into arrays. The node lines are
+    read first; the edge lines (src,dst,t1,rate1,t2,rate2,...) are then read in
+    fixed-size blocks of bytes and each block is split into fields with
+    NumPy, so memory use does not grow with the size of the text.
+    @param: file name, chunk_bytes - size of the blocks read at a time
+    @ret: node id array, edge src and dst arrays, and the per-timestep
+    estimates as CSR-style offsets into the step time and step rate arrays
+    (edge i has steps offsets[i]:offsets[i+1])
+"""
+def read_infopath(fname, chunk_bytes=2 ** 22):
+    f = open(fname, 'rb')
 
     # Break lines into the node names and the edge attributes
-    split = lines.index('\n')
+    node_names = []
+    l = f.readline()
+    while l.strip():
+        node_names.append(int(l.split(b',')[0]))
+        l = f.readline()
+
+    src = []
+    dst = []
+    counts = []
+    step_times = []
+    step_rates = []
+    while True:
+        chunk = f.read(chunk_bytes)
+        if not chunk:
+            break
+        # finish the last line of the block
+        chunk += f.readline()
 
-    # Generate graph
-    G = nx.DiGraph()
-    node_names=[int(l.split(',')[0]) for l in lines[:split]]
-    G.add_nodes_from(node_names)
+        s, d, n, t, r = parse_edge_chunk(chunk)
+        src.append(s)
+        dst.append(d)
+        counts.append(n)
+        step_times.append(t)
+        step_rates.append(r)
+    f.close()
 
-    # Clean up edges
-    edges_raw = [l.split(',') for l in lines[split+1:]]
-#    edges_clean = [((int(l[0]),int(l[1])), np.mean(map(float, l[3::2]))) for l in edges_raw]
-    edges_clean = [((int(l[0]),int(l[1])), float(l[-1])) for l in edges_raw]
-    # Add edges to graph
-    for e in edges_clean:
-        if e[1]>0:
-            G.add_edge(e[0][0],e[0][1], weight=e[1])
-    nx.write_weighted_edgelist(G, fname[:-4]+'_avg.txt')
+    counts = concat(counts, np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
 
-    return G
+    return (np.array(node_names, dtype=np.int64), concat(src, np.int64),
+            concat(dst, np.int64), offsets, concat(step_times, np.float64),
+            concat(step_rates, np.float64))
+
+
+"""
+parse_edge_chunk
+    Splits a block of complete InfoPath edge lines into arrays.
+    @param: bytes holding whole lines
+    @ret: src, dst, number of time steps per edge, step times, step rates
+"""
+def parse_edge_chunk(chunk):
+    lines = chunk.replace(b'\r', b'').split(b'\n')
+    lines = [l for l in lines if l.strip()]
+    if not lines:
+        empty = np.zeros(0)
+        return (empty.astype(np.int64), empty.astype(np.int64),
+                empty.astype(np.int64), empty, empty)
+
+    values = np.fromstring(b','.join(lines), sep=',')
+    num_fields = np.array([l.count(b',') + 1 for l in lines], dtype=np.int64)
+    starts = np.zeros(len(lines), dtype=np.int64)
+    np.cumsum(num_fields[:-1], out=starts[1:])
+
+    is_step = np.ones(len(values), dtype=bool)
+    is_step[starts] = False
+    is_step[starts + 1] = False
+
+    # a line with an odd number of step fields (e.g. src,dst,rate in the
+    # truth files) gets a nan time in front of its first rate
+    num_values = num_fields - 2
+    pad = num_values % 2
+    num_steps = (num_values + pad) // 2
+    row = np.repeat(np.arange(len(lines)), num_values)
+    step_starts = 2 * (np.cumsum(num_steps) - num_steps)
+    value_starts = np.cumsum(num_values) - num_values
+    pos = (step_starts[row] + pad[row] + np.arange(len(row)) -
+            value_starts[row])
+    steps = np.empty(2 * np.sum(num_steps))
+    steps.fill(np.nan)
+    steps[pos] = values[is_step]
+
+    return (values[starts].astype(np.int64), values[starts + 1].astype(np.int64),
+            num_steps, steps[0::2], steps[1::2])
+
+
+"""
+concat
+    Concatenates a list of arrays, giving an empty array of dtype for no input.
+"""
+def concat(arrays, dtype):
+    if not arrays:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype)
+
+
+"""
+last_rates
+    Function to pick the rate of the last time step of every edge, which is the
+    estimate load_infopath keeps (0 for an edge without any steps).
+    @param: offsets and step rates from read_infopath
+    @ret: array of rates
+"""
+def last_rates(offsets, step_rates):
+    rates = np.zeros(len(offsets) - 1)
+    has_steps = offsets[1:] > offsets[:-1]
+    rates[has_steps] = step_rates[offsets[1:][has_steps] - 1]
+    return rates
 
 
 """
@@ -52,23 +256,155 @@ load_prior
     @ret: weighted Networkx graph
 """
 def load_prior(fname):
-    # Gamma parameters
-    alpha = 1.
-    beta = 2.
-    
-    # Load graph
-    G = nx.read_edgelist(fname, delimiter=',',nodetype=int, data=(('weight',float),),create_using=nx.DiGraph())
+    import networkx as nx
+
+    A, B = load_prior_sparse(fname)
+    A = A.tocoo()
+    B = B.tocoo()
 
     # New graph to add priors to
-    R = nx.complete_graph(len(G.nodes()),create_using=nx.DiGraph())
+    R = nx.complete_graph(A.shape[0],create_using=nx.DiGraph())
     # If e was in the original graph, use its prior. Else give it a (0,0) prior.
     for e in R.edges():
-        if e in G.edges():
-            R[e[0]][e[1]]['params'] = (alpha,beta)
-        elif e not in G.edges():
-            R.add_edge(e[0],e[1],attr_dict={'params':(0.,0.)})
+        R[e[0]][e[1]]['params'] = (0.,0.)
+    for u, v, a, b in zip(A.row.tolist(), A.col.tolist(), A.data.tolist(),
+            B.data.tolist()):
+        R[u][v]['params'] = (a,b)
     return R
 
+
+# prior matrices, keyed by the file's (path, size, mtime), alpha and beta;
+# they are shared by every caller, so treat them as read-only
+PRIOR_CACHE = {}
+
+"""
+load_prior_sparse
+    Function to load the prior network as sparse Gamma(alpha, beta) parameter
+    matrices. Like load_prior, nodes are taken to be 0..N-1 where N is the
+    number of distinct nodes in the file. A directory is read as a prior
+    store (see prior.py and posterior_store.py): its N nodes are 0..N-1 in
+    store order and every edge keeps its own alpha and beta. The matrices are
+    kept in memory for the life of the process, so jobs sharing a prior read
+    it once. Edge list files may be comma or space separated.
+    @param: file name or store directory, alpha, beta - prior parameters for
+    every listed edge of an edge list file
+    @ret: N x N CSR matrices of prior alpha and prior beta
+"""
+def load_prior_sparse(fname, alpha=1., beta=2.):
+    path = os.path.abspath(fname)
+    if os.path.isdir(path):
+        from posterior_store import STORE_FIELDS, store_to_sparse
+        key = [path]
+        for name in STORE_FIELDS:
+            stat = os.stat(os.path.join(path, name + '.npy'))
+            key += [stat.st_size, stat.st_mtime]
+        key = tuple(key)
+        if key not in PRIOR_CACHE:
+            PRIOR_CACHE[key] = store_to_sparse(path)
+        return PRIOR_CACHE[key]
+
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime, alpha, beta)
+    if key in PRIOR_CACHE:
+        return PRIOR_CACHE[key]
+
+    f = open(path)
+    first = f.readline()
+    f.close()
+    delimiter = ',' if ',' in first else None
+    edges = np.loadtxt(path, delimiter=delimiter, usecols=(0,1), ndmin=2)
+    src = edges[:,0].astype(np.int64)
+    dst = edges[:,1].astype(np.int64)
+    num_nodes = len(np.unique(np.concatenate((src, dst))))
+
+    A = edge_matrix(src, dst, np.ones(len(src)), num_nodes)
+    A.data[:] = alpha
+    B = A.copy()
+    B.data[:] = beta
+
+    PRIOR_CACHE[key] = (A, B)
+    return A, B
+
+
+"""
+load_prior_graph
+    Function to load only the listed edges of the prior network, with their
+    Gamma(alpha, beta) parameters, as an EdgeGraph. Every other pair has the
+    (0, 0) prior load_prior spells out edge by edge in its complete graph.
+    @param: file name, alpha, beta - prior parameters for every listed edge
+    @ret: EdgeGraph over nodes 0..N-1 with alpha and beta
+"""
+def load_prior_graph(fname, alpha=1., beta=2.):
+    A, B = load_prior_sparse(fname, alpha, beta)
+    A = A.tocoo()
+    B = B.tocoo()
+    return EdgeGraph.from_edges(range(A.shape[0]), A.row, A.col,
+            alpha=A.data, beta=B.data)
+
+
+"""
+edge_matrix
+    Function to build an N x N CSR matrix from an edge list. Self loops and
+    edges touching nodes outside 0..N-1 are dropped and, as when adding edges
+    to a networkx graph, the last value given for a repeated edge wins.
+    @param: source and destination arrays, edge values, N
+    @ret: N x N CSR matrix
+"""
+def edge_matrix(src, dst, values, num_nodes):
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+
+    keep = ((src != dst) & (src >= 0) & (src < num_nodes) & (dst >= 0) &
+            (dst < num_nodes))
+    src, dst, values = src[keep], dst[keep], values[keep]
+
+    # first occurrence in the reversed keys is the last one in the file
+    keys = (src * num_nodes + dst)[::-1]
+    keys, first = np.unique(keys, return_index=True)
+    values = values[::-1][first]
+
+    return coo_matrix((values, (keys // num_nodes, keys % num_nodes)),
+            shape=(num_nodes, num_nodes)).tocsr()
+
+
+"""
+sparse_update
+    Conjugate Gamma update of every prior edge at once. Each InfoPath rate r is
+    one observation, adding 1 to alpha and 1/r to beta; edges with neither a
+    prior nor an InfoPath estimate are left out.
+    @param: N x N sparse prior alpha and beta, N x N sparse InfoPath rates
+    @ret: arrays of src, dst, posterior alpha, posterior beta, posterior mean
+    and posterior variance over the union of prior and InfoPath edges
+"""
+def sparse_update(A, B, R):
+    num_nodes = A.shape[0]
+    R = R.tocsr()
+    R.eliminate_zeros()
+
+    # scipy drops entries that add up to zero, so rather than adding the
+    # matrices, both sums are scattered onto the union of their keys
+    keys = []
+    for M in (A, B, R):
+        M = M.tocsr()
+        M.sum_duplicates()
+        M = M.tocoo()
+        keys.append((M.row.astype(np.int64) * num_nodes + M.col, M.data))
+    union = np.union1d(np.union1d(keys[0][0], keys[1][0]), keys[2][0])
+
+    (a_keys, a_data), (b_keys, b_data), (r_keys, r_data) = keys
+    alpha = np.zeros(len(union))
+    beta = np.zeros(len(union))
+    alpha[np.searchsorted(union, a_keys)] = a_data
+    beta[np.searchsorted(union, b_keys)] = b_data
+    r_index = np.searchsorted(union, r_keys)
+    alpha[r_index] += 1.
+    beta[r_index] += 1. / r_data
+
+    return (union // num_nodes, union % num_nodes, alpha, beta, alpha / beta,
+            alpha / beta ** 2)
+
+
 """
 update
     Updates prior network with InfoPath estimates.
@@ -76,19 +412,92 @@ update
     @ret: weighted Networkx graph
 """
 def update(infoname, priorname):
+    return update_graph(infoname, priorname).to_networkx()
+
+
+"""
+update_graph
+    The update as an EdgeGraph over nodes 0..N-1 holding the posterior alpha
+    and beta of every prior or InfoPath edge.
+    @param: infopath file name, prior file name
+    @ret: EdgeGraph
+"""
+def update_graph(infoname, priorname):
     # Load graphs
-    U = load_infopath(infoname)
-    P = load_prior(priorname)
-    
-    to_remove = []
-    # If InfoPath has an estimate for an edge, update it
-    for e in P.edges():
-        if e in U.edges():
-            P[e[0]][e[1]]['params'] = (P[e[0]][e[1]]['params'][0]+1, P[e[0]][e[1]]['params'][1]+1./U[e[0]][e[1]]['weight'])
-        if P[e[0]][e[1]]['params'] == (0,0):
-            to_remove.append(e)
-    P.remove_edges_from(to_remove)
-    return P
+    node_names, src, dst, offsets, step_times, step_rates = \
+            cached_read_infopath(infoname)
+    A, B = load_prior_sparse(priorname)
+    num_nodes = A.shape[0]
+
+    # as in load_infopath, edges without a positive estimate are dropped
+    rates = last_rates(offsets, step_rates)
+    keep = rates > 0
+    R = edge_matrix(src[keep], dst[keep], rates[keep], num_nodes)
+    profiling.count('edges_updated', R.nnz)
+
+    src, dst, alpha, beta, mean, var = sparse_update(A, B, R)
+    return EdgeGraph.from_edges(range(num_nodes), src, dst, alpha=alpha,
+            beta=beta)
+
+
+"""
+posterior_summary
+    Closed-form summaries of Gamma(alpha, beta) posteriors (beta is a rate),
+    computed for every edge at once instead of through frozen scipy
+    distributions.
+    @param: arrays of alpha and beta, quantiles to report (None or () skips
+    the quantiles, by far the costliest part)
+    @ret: arrays of mean, variance, mode and a (len(quantiles) x E) array of
+    quantiles
+"""
+def posterior_summary(alpha, beta, quantiles=(0.025, 0.975)):
+    alpha = np.asarray(alpha, dtype=np.float64)
+    beta = np.asarray(beta, dtype=np.float64)
+
+    mean = alpha / beta
+    var = alpha / beta ** 2
+    mode = np.maximum(alpha - 1., 0.) / beta
+    if quantiles is None or len(quantiles) == 0:
+        return mean, var, mode, np.zeros((0, len(mean)))
+    q = np.asarray(quantiles, dtype=np.float64).reshape(-1, 1)
+    quant = gammaincinv(alpha, q) / beta
+    return mean, var, mode, quant
+
+
+"""
+update_wrapper
+    Runs the update and writes the posterior parameters to outname and the
+    posterior means to outavgname as a comma-separated weighted edge list.
+    @param: infopath file name, prior file name, output file names, verbose -
+    print the parameters and mean of every edge
+    @ret: n/a
+"""
+def update_wrapper(infoname, priorname, outname, outavgname, verbose=True):
+    with profiling.stage('update'):
+        G = update_graph(infoname, priorname)
+    src, dst = G.edges()
+    alpha = G.alpha.tolist()
+    beta = G.beta.tolist()
+    # only the means are written
+    with profiling.stage('posterior_summary'):
+        mean = (G.alpha / G.beta).tolist()
+
+    if verbose:
+        for u, v, a, b, m in zip(src, dst, alpha, beta, mean):
+            print (a, b)
+            print (u, v), m
+    with profiling.stage('write_posterior'):
+        # the edge list networkx's write_edgelist gives for update's graph
+        w = open(outname, 'w+')
+        for u, v, a, b in zip(src, dst, alpha, beta):
+            w.write('%s %s %s\n' % (u, v, {'params': (a, b)}))
+        w.close()
+
+        w = open(outavgname, 'w+')
+        outcsv = csv.writer(w, delimiter=',', lineterminator='\n')
+        for u, v, m in zip(src, dst, mean):
+            outcsv.writerow([u, v, m])
+        w.close()
 
 
 def main():
@@ -96,18 +505,8 @@ def main():
     priorname = 'sim_data_prior.txt'
     outname = 'updated.txt'
     outavgname = 'updated_avg.txt'
-    
-    G = update(infoname, priorname)
-    for e in G.edges():
-        print G[e[0]][e[1]]['params']
-        print e, stats.gamma(G[e[0]][e[1]]['params'][0], scale=1./G[e[0]][e[1]]['params'][1]).stats(moments='m')
-    nx.write_edgelist(G,outname)
-    A = G.copy()
-    for e in A.edges():
-        p = stats.gamma(G[e[0]][e[1]]['params'][0], scale=1./G[e[0]][e[1]]['params'][1]).stats(moments='m')
-#       if p == nan: A[e[0]][e[1]]['weight'] = 0
-        A[e[0]][e[1]]['weight'] = p
-    nx.write_weighted_edgelist(A,outavgname,delimiter=',')
+
+    update_wrapper(infoname, priorname, outname, outavgname)
 
 if __name__ =='__main__':
-    main()
\ No newline at end of file
+    main()
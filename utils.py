@@ -1,17 +1,15 @@
 """
 utils.py
-Useful functions for network recovery/inference.
+Useful functions for network recovery/inference. networkx and matplotlib are
+only imported by the plotting functions, so importing this module stays
+cheap; run it as a script to plot the Ebola networks.
 """
 
-from scipy import stats
 import numpy as np
 
 import csv
-import matplotlib.pyplot as plt
-import networkx as nx
-import random
-import itertools
-from collections import defaultdict
+import profiling
+from multiprocessing.pool import ThreadPool
 
 """
 nodes
@@ -24,11 +22,10 @@ def nodes(fname):
     f = open(fname, 'rU')
     lines = [l for l in f]
 
-    # Break lines into the node names and the edge attributes
-    split = lines.index('\n')
+    # Break lines into the node names and the edge attributes (a network file
+    # has only the node lines)
+    split = lines.index('\n') if '\n' in lines else len(lines)
 
-    # Generate graph
-    G = nx.DiGraph()
     node_names=[int(l.split(',')[0]) for l in lines[:split]]
     return node_names
 
@@ -39,30 +36,227 @@ mae
     @ret: MAE value
 """
 def mae(estimate, truth, node_names):
-	td = defaultdict(int)
-	td.update({(r[0],r[1]):r[2] for r in truth})
-	ed = defaultdict(int)
-	ed.update({(r[0],r[1]):r[2] for r in estimate})
-	return np.mean([np.abs(td[k]-ed[k]) for k in itertools.product(node_names,node_names)])
+    return edge_metrics(estimate, truth, node_names)['mae']
+
+"""
+edge_metrics
+    Scores a recovered network against the true one over every ordered pair of
+    nodes in node_names, where a missing edge has weight 0. Only the edges
+    listed in either network are looked at: the two lists are joined on their
+    sorted pair keys and the pairs missing from both contribute nothing to the
+    errors and count as tied negatives with score 0 in the AUC.
+    @param: recovered network, true network as edgelists of [u,v,weight],
+    node names, thresholds - an edge is predicted when its weight is above
+    the threshold
+    @ret: dict with 'mae', 'rmse', 'auc' and 'precision'/'recall' arrays (one
+    value per threshold)
+"""
+def edge_metrics(estimate, truth, node_names, thresholds=(0.,)):
+    names, counts = np.unique(np.asarray(node_names), return_counts=True)
+    num_pairs = float(len(node_names)) ** 2
+    profiling.count('pairs_scored', int(num_pairs))
+
+    ekeys, evals = edge_keys(estimate, names)
+    tkeys, tvals = edge_keys(truth, names)
+
+    # align both lists on the union of their keys
+    keys = np.union1d(ekeys, tkeys)
+    e = np.zeros(len(keys))
+    e[np.searchsorted(keys, ekeys)] = evals
+    t = np.zeros(len(keys))
+    t[np.searchsorted(keys, tkeys)] = tvals
+    # repeated node names count their pairs more than once, as in a product
+    weight = (counts[keys // len(names)] * counts[keys % len(names)]).astype(
+            np.float64)
+
+    err = np.abs(e - t)
+    metrics = {
+        'mae': np.sum(weight * err) / num_pairs,
+        'rmse': np.sqrt(np.sum(weight * err ** 2) / num_pairs),
+    }
+
+    actual = t > 0
+    precision = []
+    recall = []
+    for threshold in thresholds:
+        predicted = e > threshold
+        tp = np.sum(weight[predicted & actual])
+        num_predicted = np.sum(weight[predicted])
+        num_actual = np.sum(weight[actual])
+        precision.append(tp / num_predicted if num_predicted else np.nan)
+        recall.append(tp / num_actual if num_actual else np.nan)
+    metrics['precision'] = np.array(precision)
+    metrics['recall'] = np.array(recall)
+
+    metrics['auc'] = pair_auc(e[actual], weight[actual], e[~actual],
+            weight[~actual], num_pairs - np.sum(weight))
+    return metrics
+
+"""
+edge_keys
+    Converts an edgelist into sorted integer pair keys over node_names. Edges
+    touching other nodes are dropped and the last weight of a repeated edge
+    wins.
+    @param: edgelist of [u,v,weight], sorted unique node names
+    @ret: sorted key array, weight array
+"""
+def edge_keys(edges, names):
+    edges = np.asarray(edges, dtype=np.float64).reshape(-1, 3)
+    src = np.searchsorted(names, edges[:,0])
+    dst = np.searchsorted(names, edges[:,1])
+    src = np.minimum(src, len(names) - 1)
+    dst = np.minimum(dst, len(names) - 1)
+    keep = (names[src] == edges[:,0]) & (names[dst] == edges[:,1])
+
+    keys = (src * len(names) + dst)[keep][::-1]
+    vals = edges[:,2][keep][::-1]
+    keys, first = np.unique(keys, return_index=True)
+    return keys, vals[first]
+
+"""
+pair_auc
+    Weighted ROC AUC with ties counted as half, plus a block of extra
+    negatives that all score 0.
+    @param: positive scores and weights, negative scores and weights, weight
+    of the implicit zero-score negatives
+    @ret: AUC value (nan without both positives and negatives)
+"""
+def pair_auc(pos, pos_weight, neg, neg_weight, zero_weight):
+    total_pos = np.sum(pos_weight)
+    total_neg = np.sum(neg_weight) + zero_weight
+    if total_pos == 0 or total_neg == 0:
+        return np.nan
+
+    order = np.argsort(neg, kind='mergesort')
+    neg = neg[order]
+    cum = np.concatenate(([0.], np.cumsum(neg_weight[order])))
+    lo = np.searchsorted(neg, pos, side='left')
+    hi = np.searchsorted(neg, pos, side='right')
+
+    below = cum[lo] + zero_weight * (pos > 0)
+    tied = cum[hi] - cum[lo] + zero_weight * (pos == 0)
+    return np.sum(pos_weight * (below + .5 * tied)) / (total_pos * total_neg)
 
 """
 pair_dist
-    Calculates pairwise (Hamming) distances between genetic sequences.
-    @param: numpy array of sequences
+    Calculates pairwise (Hamming) distances between genetic sequences. Only the
+    upper triangle is computed, one block of rows against one block of columns
+    at a time so memory stays bounded by the block size. Unpacked sequences
+    are compared by counting matches as one-hot matrix products; with packed
+    the sequences are first encoded at 2 bits per base (see pack_sequences)
+    and compared with XOR and a popcount table.
+    @param: numpy array of sequences, block_size - rows per block (256, or 32
+    when packed since the XOR block grows with its square), packed - use the
+    2-bit encoding (A/C/G/T only), threads - split the row blocks over a
+    thread pool
     @ret: pairwise distance matrix
 """
-def pair_dist(seqarray):
-    pd = np.zeros((seqarray.shape[0],seqarray.shape[0]))
-    for i,j in itertools.product(xrange(seqarray.shape[0]),xrange(seqarray.shape[0])):
-        pd[i,j] = np.sum(seqarray[i]!=seqarray[j])
+def pair_dist(seqarray, block_size=None, packed=False, threads=1):
+    seqarray = np.asarray(seqarray)
+    num_seqs, seq_len = seqarray.shape
+    pd = np.zeros((num_seqs, num_seqs))
+    if block_size is None:
+        block_size = 32 if packed else 256
+
+    if packed:
+        seqarray = pack_sequences(seqarray)
+        block_dist = packed_block_dist
+    else:
+        symbols = np.unique(seqarray)
+        dtype = np.float32 if seq_len < 2 ** 24 else np.float64
+        def block_dist(a, b):
+            return onehot_block_dist(a, b, symbols, dtype)
+
+    starts = range(0, num_seqs, block_size)
+    def fill_rows(i):
+        rows = seqarray[i:i + block_size]
+        for j in starts:
+            if j < i:
+                continue
+            d = block_dist(rows, seqarray[j:j + block_size])
+            pd[i:i + block_size, j:j + block_size] = d
+            pd[j:j + block_size, i:i + block_size] = d.T
+
+    if threads > 1:
+        pool = ThreadPool(threads)
+        pool.map(fill_rows, starts)
+        pool.close()
+        pool.join()
+    else:
+        for i in starts:
+            fill_rows(i)
     return pd
 
+"""
+onehot_block_dist
+    Hamming distances between two blocks of unpacked sequences: the sequence
+    length minus the matches counted symbol by symbol as matrix products.
+    @param: two blocks of sequences, alphabet, float dtype for the products
+    @ret: distance block
+"""
+def onehot_block_dist(a, b, symbols, dtype):
+    matches = np.zeros((a.shape[0], b.shape[0]), dtype=dtype)
+    for c in symbols:
+        matches += np.dot((a == c).astype(dtype), (b == c).astype(dtype).T)
+    return a.shape[1] - matches
+
+"""
+packed_block_dist
+    Hamming distances between two blocks of 2-bit packed sequences. A base
+    differs when either bit of its XOR is set.
+    @param: two blocks of packed sequences
+    @ret: distance block
+"""
+def packed_block_dist(a, b):
+    diff = np.bitwise_xor(a[:,None,:], b[None,:,:])
+    diff = (diff | (diff >> 1)) & 0x55
+    return POPCOUNT[diff].sum(axis=2, dtype=np.int64)
+
+# number of set bits in every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# 2-bit code of every byte value, 255 for anything that is not a nucleotide
+BASE_CODE = np.empty(256, dtype=np.uint8)
+BASE_CODE.fill(255)
+for i, bases in enumerate(['Aa', 'Cc', 'Gg', 'TtUu']):
+    for base in bases:
+        BASE_CODE[ord(base)] = i
+
+"""
+pack_sequences
+    Encodes nucleotide sequences at 2 bits per base, four bases per byte.
+    @param: numpy array of single-character bases (A/C/G/T/U, any case) or of
+    integer codes 0-3
+    @ret: uint8 array of shape (num_seqs, ceil(seq_len / 4))
+"""
+def pack_sequences(seqarray):
+    seqarray = np.asarray(seqarray)
+    if seqarray.dtype.kind in 'iu':
+        codes = seqarray.astype(np.uint8)
+        if np.any(seqarray < 0) or np.any(seqarray > 3):
+            raise ValueError('integer bases must be coded 0-3')
+    else:
+        raw = seqarray.astype('S1').view(np.uint8).reshape(seqarray.shape)
+        codes = BASE_CODE[raw]
+        if np.any(codes == 255):
+            raise ValueError('packed sequences may only contain A, C, G, T')
+
+    num_seqs, seq_len = codes.shape
+    padded = np.zeros((num_seqs, 4 * ((seq_len + 3) // 4)), dtype=np.uint8)
+    padded[:,:seq_len] = codes
+    padded = padded.reshape(num_seqs, -1, 4)
+    return (padded[:,:,0] | (padded[:,:,1] << 2) | (padded[:,:,2] << 4) |
+            (padded[:,:,3] << 6)).astype(np.uint8)
+
 """
 draw_graph
     Plots the networkx graph from a file with the edge transparency varying by
     the transmission rate for each edge.
 """
 def draw_graph(fname, network_file, title, pos=None):
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
     G = nx.read_edgelist(fname, delimiter=' ',nodetype=int,
             data=(('weight',float),),create_using=nx.Graph())
 
@@ -145,5 +339,7 @@ def plot_ebola_networks():
             'ebola_data/node_ids.txt',
             'InfoPath Inferred', pos)
 
-plot_ebola_networks()
+
+if __name__ == "__main__":
+    plot_ebola_networks()
 